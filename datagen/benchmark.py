@@ -0,0 +1,237 @@
+'''
+Benchmarks the stages of cov19_con_trace.py on the datasets shipped in this folder (5, 10
+and 30 people, the 1k and 2k populations) and on larger populations generated with
+generator.py. Every stage of a full run (dataprep, trajectory store, overlaps, graph,
+exposures and graph analysis) is timed on its own and the following are recorded per stage:
+ - secs: wall time of the stage
+ - peak_rss_mb: peak memory of the process during the stage, the high-water mark is reset
+   before every stage (linux only, on other systems it is the peak of the run so far)
+ - haversine_evals, latlon_evals: loc pair distances calculated in the stage
+ - candidate_pairs, breaches, high_risk: loc pairs compared in the stage, the ones within the
+   microcell radius and the high risk ones (see run_counters in cov19_con_trace.py)
+
+Each dataset is run in a fresh process so peak memory is that of the dataset alone. The
+report is written as json to bench_report. Set bench_baseline to the report of an earlier
+commit to compare against it, stages that got slower or bigger by more than
+bench_tolerance are listed as regressions.
+
+Configurations of cov19_con_trace.py (microcell radius, spatial index, graph backend, etc.)
+are used as they are set in that file and are recorded in the report. The overlaps are
+always found in one process (overlap_workers = 1), as the memory of worker processes is not
+that of the benchmark process.
+
+Dependencies:
+- same as generator.py and cov19_con_trace.py
+- linux, for the peak memory of a process
+
+'''
+
+import os
+import json
+import time
+import platform
+import resource
+import subprocess
+import multiprocessing
+import pandas as pd
+import generator as gen
+import cov19_con_trace as ct
+
+##### All configurations start here #####
+
+#datasets shipped in this folder to benchmark, relative to it
+bench_datasets = [
+    'cov19_gen_dataset_pop-05_doctored_sickper-05_startloc-07/cov19_gen_dataset_05_doctored.csv',
+    'cov19_gen_dataset_pop-10_sickper-03_startloc-02/cov19_gen_dataset_pop-10_sickper-03_startloc-02.csv',
+    'cov19_gen_dataset_pop-10_sickper-05_startloc-07/cov19_gen_dataset_pop-10_sickper-05_startloc-07.csv',
+    'cov19_gen_dataset_pop-30_sickper-03_startloc-07/cov19_gen_dataset_pop-30_sickper-03_startloc-07.csv',
+    'large_pop_datasets_only/cov19_gen_dataset_1k.csv',
+    'large_pop_datasets_only/cov19_gen_dataset_2k.csv']
+
+#populations generated with generator.py and benchmarked after the shipped datasets.
+#They are generated once with bench_seed and reused by later runs. The overlap stage
+#grows with the square of the population.
+bench_gen_pops = [3000]
+bench_seed = 2020
+
+#folder the generated datasets and the output of every run are written to
+bench_dir = 'bench'
+
+#file the report is written to, in bench_dir
+bench_report = 'bench_report.json'
+
+#report of an earlier run to compare with. '' = no comparison.
+bench_baseline = ''
+#stages that take this much longer (0.25 = 25%) or more memory than in bench_baseline are
+#regressions. Stages that take less than bench_min_secs in both are not compared on time.
+bench_tolerance = 0.25
+bench_min_secs = 0.05
+
+##### All configurations end here   #####
+
+#counters of cov19_con_trace.py recorded per stage, see run_counters there
+bench_counters = ['haversine_evals', 'latlon_evals', 'candidate_pairs', 'breaches', 'high_risk']
+
+col_bench = ['dataset', 'people', 'readings', 'stage', 'secs', 'peak_rss_mb'] + bench_counters
+
+#resets the peak memory of this process (see peak_rss_mb) to its current memory. Only
+#possible on linux, elsewhere the peak stays that of the whole run.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+#returns the peak memory of this process in MB since reset_peak_rss, or since it started
+#where /proc is not there. Both VmHWM and ru_maxrss are in KB on linux.
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if(line.startswith('VmHWM:')):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+#runs one stage and appends its row to rows. Returns what the stage returns.
+def run_stage(rows, stage, f):
+    counters = dict(ct.run_counters)
+    reset_peak_rss()
+    start = time.time()
+    result = f()
+    row = {'stage': stage, 'secs': time.time() - start, 'peak_rss_mb': peak_rss_mb()}
+    for c in bench_counters:
+        row[c] = ct.run_counters.get(c, 0) - counters.get(c, 0)
+    rows.append(row)
+    return result
+
+#generates a population with generator.py, if not there yet. Returns the path of its csv.
+def gen_dataset(pop):
+    name = "cov19_gen_dataset_pop-%d_seed-%d" % (pop, bench_seed)
+    path = os.path.join(bench_dir, name + ".csv")
+    if(os.path.exists(path)):
+        return path
+    gen.total_pop = pop
+    gen.no_of_sick_allowed = max(1, (pop * gen.sick_percent) / 100)
+    gen.gen_output_format = 0
+    gen.gen_date = '01-06-2020'
+    ct.printcov("Generating benchmark population of: " + str(pop))
+    return gen.write_batches(gen.gen_population_batches(pop, bench_seed), os.path.join(bench_dir, name))
+
+#runs every stage of a full run of cov19_con_trace.py on one dataset, the same way its MAIN
+#does, inside the dataset's folder in bench_dir. Runs in its own process (see run_bench).
+#Returns the rows of the stages.
+def bench_task(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    folder = os.path.join(bench_dir, name)
+    if(not os.path.isdir(folder)):
+        os.makedirs(folder)
+    os.chdir(folder)
+    #only the timings are of interest here, the analysis results are not printed
+    ct.log_level = ct.log_warn
+
+    rows = []
+    ct.datapath = path
+    ct.persons = []
+    df = run_stage(rows, 'prep', ct.dataprep)
+    ct.sorteddf = df
+    ct.known_infected_list = df.loc[df['condition'] == 'sick']['name'].unique()
+
+    if(ct.trajectory_store == 1):
+        population = run_stage(rows, 'store', lambda: ct.build_trajectory_store(df))
+    else:
+        def graphs():
+            for person in ct.persons:
+                ct.graph_per_person(person)
+            return ct.gxarry_pop_travel_hist
+        population = run_stage(rows, 'store', graphs)
+
+    if(ct.distance_kernel == 1 and ct.verify_distance_kernel == 1):
+        run_stage(rows, 'kernel_check', lambda: ct.check_distance_kernel(population))
+
+    if(ct.graph_backend == 1):
+        hist = run_stage(rows, 'overlaps', lambda: ct.overlaps_for_pop(population))
+        ct.biggx = run_stage(rows, 'graph', lambda: ct.build_contact_graph(ct.as_store(population), hist))
+    else:
+        ct.biggx = run_stage(rows, 'graph', lambda: ct.build_bigdaddy(population))
+        hist = run_stage(rows, 'overlaps', lambda: ct.overlaps_for_pop(population))
+
+    if(ct.exposure_stage == 1):
+        store = ct.as_store(population) if ct.trajectory_store == 1 else ct.build_trajectory_store(df)
+        run_stage(rows, 'exposures', lambda: ct.rank_exposures(ct.find_exposures(hist, store), store))
+
+    run_stage(rows, 'analysis', lambda: ct.run_graph_analysis(ct.biggx))
+
+    for row in rows:
+        row.update({'dataset': name, 'people': len(ct.persons), 'readings': len(df)})
+    return rows
+
+#returns the commit the benchmark is run on, '' if not known
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+#benchmarks all datasets and returns the report
+def run_bench():
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(here, d) for d in bench_datasets]
+    paths.extend([os.path.abspath(gen_dataset(pop)) for pop in bench_gen_pops])
+    #peak memory is that of one process, the overlaps must not be split across workers
+    ct.overlap_workers = 1
+
+    results = []
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for rows in pool.imap(bench_task, paths):
+            results.extend(rows)
+            ct.printcov("Benchmarked: " + rows[0]['dataset'] + " in " +
+                str(round(sum(r['secs'] for r in rows), 2)) + " secs.")
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    config = dict((c, getattr(ct, c)) for c in ('microcell_radius', 'spatial_index', 'time_sweep',
+        'distance_kernel', 'symmetric_pairs', 'mirror_travel_hist', 'overlap_workers',
+        'trajectory_store', 'travel_hist_breach_only', 'graph_backend', 'exposure_stage'))
+    return {'commit': git_commit(), 'python': platform.python_version(),
+        'machine': platform.platform(), 'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': config, 'results': results}
+
+#compares the results of a report with the ones of a baseline report. Returns the stages
+#that are slower or bigger by more than bench_tolerance, as a DataFrame.
+def compare_reports(baseline, report):
+    old = pd.DataFrame(baseline['results'], columns=col_bench)
+    new = pd.DataFrame(report['results'], columns=col_bench)
+    both = new.merge(old, on=['dataset', 'stage'], suffixes=('', '_base'))
+    slower = ((both['secs'] > both['secs_base'] * (1 + bench_tolerance)) &
+        (both[['secs', 'secs_base']].max(axis=1) >= bench_min_secs))
+    bigger = both['peak_rss_mb'] > both['peak_rss_mb_base'] * (1 + bench_tolerance)
+    return both.loc[slower | bigger, ['dataset', 'stage', 'secs_base', 'secs',
+        'peak_rss_mb_base', 'peak_rss_mb', 'haversine_evals_base', 'haversine_evals']]
+
+################
+##### MAIN #####
+################
+if __name__ == '__main__':
+    if(not os.path.isdir(bench_dir)):
+        os.makedirs(bench_dir)
+    bench_dir = os.path.abspath(bench_dir)
+    ct.printcov("Starting benchmark of " + str(len(bench_datasets) + len(bench_gen_pops)) +
+        " datasets in: " + bench_dir)
+    report = run_bench()
+    print(pd.DataFrame(report['results'], columns=col_bench).to_string())
+    with open(os.path.join(bench_dir, bench_report), 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    ct.printcov("Saved benchmark report to: " + os.path.join(bench_dir, bench_report))
+
+    if(bench_baseline != ''):
+        with open(bench_baseline) as f:
+            regressions = compare_reports(json.load(f), report)
+        ct.printcov("Regressions against " + bench_baseline + ": " + str(len(regressions)))
+        print(regressions.to_string())
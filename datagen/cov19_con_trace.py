@@ -18,6 +18,7 @@ Dependencies:
 - Python 2.7 only (latlon doesn't support Python 3 :(. For python 3+, use pyGeodesy)
 - LatLon 1.0.2 - https://pypi.org/project/LatLon/
 - pandas 0.24.2
+- numpy 1.16
 - networkx 2.2 ( !pip install networkx=2.2. 2.2 due to python 2.7 - use latest if on Python 3+ )
 - python-louvain 0.13 ( !pip install python-louvain )
 - matplotlib 2.2.4
@@ -25,12 +26,23 @@ Dependencies:
 '''
 
 import pandas as pd
+import numpy as np
 import LatLon
 from LatLon import *
 import networkx as nx
 import matplotlib.pyplot as plt
 import time
-from copy import deepcopy
+import math
+import json
+import functools
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+import hashlib
+import pickle
+import gzip
 import community
 
 ##### All configurations start here #####
@@ -46,6 +58,141 @@ datapath = 'cov19_gen_dataset_05_doctored.csv' #'cov19_gen_dataset_10k.csv'
 #can be changed to anything, default is kept at x metres. This is for tagging high risk contacts.
 microcell_radius = 0.005 # e.g., say is set to 0.003. It is about 10 ft captured here in (3) metres
 
+#controls how candidate location pairs are picked before the microcell distance check.
+#0 = brute force. Every loc of every person is compared with every loc of every other person.
+#1 = spatial grid index. Locs are bucketed in grid cells at least microcell_radius wide and only
+#locs in the same or adjacent cells are compared. Breaches found are identical to 0 but the
+#travel history only holds the compared (nearby) pairs instead of all pairs.
+spatial_index = 1
+
+#controls whether locs are first joined on time. 0 = off. 1 = time sweep, the [entry, exit]
+#window of every loc is sorted and only loc pairs whose windows intersect are checked for a
+#microcell breach. risk = 'high' and 'infec_start_loc' results are identical to 0, but
+#breaches without a time overlap are never looked at so are not marked in the graph.
+time_sweep = 0
+
+#controls how the distance between two locs is calculated. 0 = LatLon distance, one pair at a
+#time. 1 = vectorized haversine kernel over numpy arrays, all compared pairs of two people in
+#one call. Haversine is within ~0.6% of the LatLon (WGS84) distance, so pairs that fall within
+#distance_kernel_rtol of microcell_radius are rechecked with LatLon and breaches stay identical.
+distance_kernel = 1
+distance_kernel_rtol = 0.006
+
+#controls how pairs of people are compared. 0 = every ordered pair, i.e. both (A, B) and (B, A),
+#so each breach edge is added to the graph twice. 1 = every unordered pair is compared once and
+#each breach edge is added once. Halves the overlap work.
+symmetric_pairs = 0
+
+#only used when symmetric_pairs = 1. 1 = the travel history still holds both directions, the
+#(B, A) rows are mirrored from the (A, B) ones at output time so the layout is the same as
+#with symmetric_pairs = 0. 0 = the travel history holds each unordered pair once.
+mirror_travel_hist = 1
+
+#number of worker processes used in the overlap phase. 1 = everything runs in this process.
+#Workers get read only coordinate / time arrays of the population, find the overlaps of a
+#chunk of anchor people and send back their travel history rows. Rows are marked on the graph
+#and merged back in a fixed order, so the output is the same for any number of workers.
+overlap_workers = 1
+#number of anchor people handed to a worker at a time
+overlap_chunksize = 16
+
+#when set to 1 the distance kernel is checked against LatLon on a sample of the loaded data
+#before overlaps are calculated and the run stops if it is not within distance_kernel_rtol.
+#kernel_check.py checks it on all the shipped datasets instead.
+verify_distance_kernel = 0
+
+#controls how the travel history of each person is held. 0 = one networkx graph per person
+#(see graph_per_person). 1 = trajectory store, flat numpy arrays of all readings of the
+#population (see build_trajectory_store). Both give the same results, the store takes a few
+#tens of bytes per reading instead of a graph node with a LatLon object.
+trajectory_store = 1
+
+#controls how the data file is read. 0 = all of it is loaded in memory (see dataprep). 1 = streaming
+#ingest for populations that do not fit in memory. The file is read in chunks, readings are spilled
+#to disk partitioned by location and time and each partition is then traced on its own (see
+#stream_overlaps). Each person's readings must be together in the file, as generator.py writes them.
+#Only time overlapping locs are compared, like time_sweep = 1, and the graph only holds the
+#breached locs instead of the full travel history of the population.
+stream_ingest = 0
+#memory budget of the streaming ingest in MB. Sizes the chunks read from the file and the
+#readings loaded at a time. A partition too big for it is joined in rows of sub-cells (see
+#join_partition_rows). Only the readings are bounded, the graph (biggx) and the names and
+#conditions of the population are held in memory whatever the budget.
+stream_memory_mb = 512
+#size of the spatial partitions in km (never smaller than microcell_radius) and of the time
+#partitions in minutes. Lower these if a partition is reported over the memory budget even
+#once split into sub-cells as narrow as microcell_radius.
+stream_partition_km = 0.5
+stream_time_bucket = 60
+#folder the partitions are spilled to. '' = a temp folder. It is removed when done.
+stream_spill_dir = ''
+
+#controls how the travel history is saved. 0 = travelhist_df.csv, one text row per compared loc
+#pair. 1 = travelhist_df.npz, compressed numpy columns (see save_travel_hist), a fraction of the
+#size of the csv. read_travel_hist loads it back and travel_hist_frame gives the csv layout.
+#Streaming ingest writes the npz columns as parts in the folder travelhist_df_npz instead.
+travel_hist_format = 0
+#1 = only the loc pairs that breached the microcell are kept in the travel history. 0 = all
+#compared loc pairs are kept.
+travel_hist_breach_only = 0
+
+#controls the exposure stage. 1 = breaches where two people were at their locs at the same time
+#are merged into co-location episodes per pair of people (see find_exposures) and the pairs are
+#saved to exposure_df.csv, the longest total time together first. 0 = off. Not done with
+#streaming ingest or microcell_radii.
+exposure_stage = 1
+
+#controls the stage cache. 1 = the results of dataprep, the trajectory store and the overlaps
+#(biggx and the travel history) are saved in stage_cache_dir, keyed by a hash of the data file
+#and the configurations each stage depends on. A run with the same data and configurations
+#loads them and goes straight to the graph analysis. 0 = every stage is always run.
+#Not used with streaming ingest, microcell_radii only reuses dataprep and the store.
+stage_cache = 0
+stage_cache_dir = 'stage_cache'
+
+#folder holding the state of incremental tracing. '' = off. Otherwise, if the folder has no
+#state yet, a full run is done and its trajectory store and graph are saved there. If it has
+#one, datapath is taken as a batch of new readings and only they are traced against the
+#saved state (see trace_new_readings). Only the changes are then saved to the folder, as a
+#delta next to the state (see save_trace_state).
+incremental_state_dir = ''
+
+#condition changes applied to the saved state of incremental tracing, e.g. {'IHDELNV': 'healthy'}
+#when a person has recovered. Only the risk markings that depend on them are worked out again
+#(see set_condition). {} = no changes.
+condition_updates = {}
+
+#list of microcell radii to run the analysis for in one go, e.g. [0.005, 0.01, 0.02]. Loc
+#pair distances are calculated once and thresholded for every radius, each radius gets its
+#own travelhist_df_mcradius-<radius>, graph_mcradius-<radius>.gz and graph analysis. The
+#travel history holds each loc pair once. [] = only microcell_radius is used.
+microcell_radii = []
+
+#number of breached locs with the most connections reported as high traffic locations
+high_traffic_top_k = 5
+
+#length of the contact chains followed when predicting infection locations. 1 = people met
+#by the known infected, 2 = also the people they met afterwards, 3 = and so on.
+predict_max_hops = 2
+
+#controls how the graph of the population (biggx) is held for the graph analysis. 0 = networkx
+#MultiGraph with a dict per node and edge. 1 = contact graph, CSR adjacency arrays indexed by
+#reading (see build_contact_graph), built after the overlaps from the trajectory store and the
+#breaches in the travel history. Degree, neighbour and community queries run on the arrays and
+#it is saved as graph.npz. It is turned into a networkx graph only to display it or to start
+#incremental tracing. Streaming ingest and microcell_radii always use networkx.
+graph_backend = 0
+
+#how much is printed while running. 0 = warnings and the summary of the run only. 1 = progress
+#of the stages and the results of the graph analysis. 2 = debug, also every person, loc and
+#loc pair with its distance as they are processed. Debug output is not even formatted below
+#2, printing it takes most of the time of the overlaps of a large population.
+log_level = 1
+
+#seconds the configurations are shown for at the start of a run, to have a look at them before
+#the analysis output scrolls them away. 0 = start right away.
+startup_pause = 7.7
+
 #controls whether graphs are visually displayed or not. If running on linux ensure X Windows is available.
 #0 = graphs are displayed in ui. 1 = no graphs are displayed.
 ui = 1
@@ -58,12 +205,57 @@ sorteddf = pd.DataFrame() #same as raw data frame except all locations are sorte
 persons = []
 gxarry_pop_travel_hist = [] #array of nx graphs holding travel history of each member in pop
 undir_gxarray_pop_travel_hist = []#same graph as gxarry_pop_travel_hist except it is undirected
+trajstore = {} #array backed trajectories of the population, see build_trajectory_store
+worker_overlap = {} #trajectory store and indices of the population inside an overlap worker
+
+#lower bounds of km per degree on the WGS84 ellipsoid. Used to size the spatial index cells so
+#that a cell is never narrower than microcell_radius, whatever the latitude.
+km_per_deg_lat = 110.574
+km_per_deg_lon_equator = 111.319
+
+#mean earth radius in km used by the haversine distance kernel
+earth_radius_km = 6371.0088
+
+#bump to invalidate the stage cache when the stages change
+stage_cache_version = 2
+
+#rough size in memory of one csv row once read by pandas, used to size streaming chunks
+stream_row_bytes = 400
+
+#record of a reading spilled to disk by the streaming ingest
+spill_dtype = np.dtype([('person', np.int32), ('node', np.int32), ('lat', np.float64),
+    ('lon', np.float64), ('time', np.int32), ('entry', np.int32), ('exit', np.int32)])
+
 col_breach = ['name1','con1','latlon1','entrytm1','exittm1','name2','con2','latlon2',
     'entrytm2','exittm2','dist','breach', 'risk']
 
+#columns of the travel history buffers and their types, see new_travel_hist. Times are in
+#minutes of the day, persons are indices into the names / cons of the population.
+col_travel_hist = [('person1', np.int32), ('node1', np.int32), ('lat1', np.float64),
+    ('lon1', np.float64), ('entry1', np.int32), ('exit1', np.int32),
+    ('person2', np.int32), ('node2', np.int32), ('lat2', np.float64),
+    ('lon2', np.float64), ('entry2', np.int32), ('exit2', np.int32),
+    ('dist', np.float64), ('breach', np.bool_), ('high', np.bool_)]
+
+#columns of the exposure ranking, see rank_exposures
+col_exposure = ['name1', 'con1', 'name2', 'con2', 'episodes', 'minutes', 'min_dist', 'first', 'last']
+
+#arrays of a contact graph saved to graph.npz, see build_contact_graph
+col_contact_graph = ['offsets', 'lat', 'lon', 'time', 'entry', 'exit', 'indptr', 'indices',
+    'breach1', 'breach2', 'breached', 'infec']
+
+#columns of the readings of a trace store and of a batch of new readings, see trace_store
+col_trace_store = [('lat', np.float64), ('lon', np.float64), ('time', np.int32),
+    ('entry', np.int32), ('exit', np.int32)]
+col_trace_readings = [('person', np.int64), ('node', np.int64), ('lat', np.float64),
+    ('lon', np.float64), ('time', np.int32)]
+
+#smallest modularity gain for which louvain on a contact graph keeps moving nodes
+louvain_min_gain = 1e-7
+
 #holds info of all possible travels by the population and which two people were involved. This
 #is used to generate a risk profile for the population.
-travel_hist = pd.DataFrame(columns = col_breach)
+travel_hist = {}
 
 #graph with various new edges and attributes on both nodes and edges. Used for
 #overall analysis activities.
@@ -72,52 +264,123 @@ biggx = nx.Graph()
 #list of known infected people
 known_infected_list = []
 
+#exposure ranking of a full run (see save_exposures), None if there is none
+exposures = None
+
+#levels of printcov and printlog, see log_level
+log_warn = 0
+log_info = 1
+log_debug = 2
+
+#time spent in each stage of the run so far, stage -> {'calls', 'secs'}. See timed.
+stage_stats = {}
+
+#counters of the run so far, see add_count. Counters of overlap worker processes are added
+#once their task is done.
+# - candidate_pairs: loc pairs compared, breaches: of these the ones within the microcell
+#   radius and high_risk: the breaches that overlap in time with one of the two people sick.
+#   With microcell_radii they are summed over every radius.
+# - haversine_evals, latlon_evals: loc pair distances calculated, by method
+# - time_overlap_pairs: loc pairs the time sweep found to overlap in time
+run_counters = {}
+
 ##### Methods #####
 
-#customized printer
-def printcov(str_to_print):
-    print("[log]:--> " + str_to_print)
+#customized printer. Prints only if log_level is at least level.
+def printcov(str_to_print, level=log_info):
+    if(log_level >= level):
+        print("[log]:--> " + str_to_print)
+
+#prints an object as is (a DataFrame, a list, etc.) if log_level is at least level
+def printlog(obj, level=log_info):
+    if(log_level >= level):
+        print(obj)
+
+#decorator that times a stage of the run. The calls and the seconds spent are added up in
+#stage_stats under the name of the function. Stages that call other stages include their time.
+def timed(f):
+    @functools.wraps(f)
+    def timed_stage(*args, **kwargs):
+        start = time.time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            stats = stage_stats.setdefault(f.__name__, {'calls': 0, 'secs': 0.0})
+            stats['calls'] += 1
+            stats['secs'] += time.time() - start
+    return timed_stage
+
+#adds n to a counter of the run, see run_counters
+def add_count(name, n=1):
+    run_counters[name] = run_counters.get(name, 0) + int(n)
+
+#returns the stage times and the counters of the run so far as a dict of 'stages' (see
+#stage_stats) and 'counters' (see run_counters). Later work does not change what is returned.
+def run_stats():
+    return {'stages': dict((stage, dict(stats)) for (stage, stats) in stage_stats.items()),
+        'counters': dict(run_counters)}
+
+#clears the stage times and the counters, e.g. to trace several datasets in one process
+def reset_run_stats():
+    stage_stats.clear()
+    run_counters.clear()
+
+#returns the stages of run_stats as a DataFrame, the slowest one first
+def run_stats_frame(stats):
+    rows = [dict(stats['stages'][stage], stage=stage) for stage in stats['stages']]
+    df = pd.DataFrame(rows, columns=['stage', 'calls', 'secs'])
+    return df.sort_values(by=['secs'], ascending=False).reset_index(drop=True)
+
+#prints the stage times and the counters of the run and saves them as json to filename
+def save_run_stats(filename):
+    stats = run_stats()
+    printcov("Time spent per stage, stages include the stages they call: ", log_warn)
+    printlog(run_stats_frame(stats).to_string(), log_warn)
+    printcov("Counters: " + ", ".join(name + ": " + str(stats['counters'][name])
+        for name in sorted(stats['counters'])), log_warn)
+    with open(filename, 'w') as f:
+        json.dump(stats, f, indent=1, sort_keys=True)
+    printcov("Saved run stats to: " + filename)
 
 #Cleans and perpares data to be suitable for running analysis. Typically, this involves
 #finding each unique person in the dataset, sorting the location records by time in an
 #ascending order and others.
+@timed
 def dataprep():
     rawdataframe = pd.read_csv(datapath, sep=',', header=0)
     
-    printcov("Sample of loaded raw data: ")
-    print(rawdataframe.head(3))
-    print(rawdataframe.tail(3))
+    printcov("Sample of loaded raw data: ", log_debug)
+    printlog(rawdataframe.head(3), log_debug)
+    printlog(rawdataframe.tail(3), log_debug)
 
     popcount = 0
-    lastname = ""
-    dftmp = pd.DataFrame()
+    sortedgroups = []
+
+    #our goal is to get each unique name and then prepare data for that. The rows are
+    #grouped by name in a single pass, groups come out in order of first appearance.
+    for currname, df in rawdataframe.groupby('name', sort=False):
+        printcov("Processing for: " + str(currname), log_debug)
+        persons.append(currname)
+        printcov("# of rows found: " + str(len(df)), log_debug)
+        popcount = popcount + 1
 
-    #our goal is to get each unique name and then prepare data for that.
-    for index, row in rawdataframe.iterrows():
-        currname = row['name']
-        if(currname != lastname):
-            printcov("Processing for: " + currname)
-            persons.append(currname)
-            df = rawdataframe.loc[rawdataframe['name'] == currname]
-            printcov("# of rows found: " + str(len(df)))
-            popcount = popcount + 1
-
-            #now to sort the rows by time. We ignore the Date field as we are assuming
-            #that the data is of a single day only.
-            df = df.sort_values(by=['time'])
-            
-            #finally append this to the sorted df
-            dftmp = dftmp.append(df)
-            lastname = currname
+        #now to sort the rows by time. We ignore the Date field as we are assuming
+        #that the data is of a single day only.
+        sortedgroups.append(df.sort_values(by=['time']))
+
+    #finally put all of them together in one go
+    dftmp = pd.DataFrame()
+    if(len(sortedgroups) > 0):
+        dftmp = pd.concat(sortedgroups)
 
     printcov("Completed prep for data.")
     #sorteddf = sorteddf.append(dftmp)
     dftmp = dftmp.reset_index(drop=True)
-    printcov("Prepp'd data: ")
-    print(dftmp.head(27))
-    print(dftmp.tail(27))
+    printcov("Prepp'd data: ", log_debug)
+    printlog(dftmp.head(27), log_debug)
+    printlog(dftmp.tail(27), log_debug)
     printcov("Unique people found in pop of size: " + str(popcount))
-    print(persons)
+    printlog(persons, log_debug)
     printcov("Saving prepp'd data to a file: preppd_df.csv for debugging (in current folder).")
     dftmp.to_csv("preppd_df.csv")
 
@@ -127,11 +390,12 @@ def dataprep():
 #history with locations and time. Also generates and adds useful attributes to nodes 
 #and edges that help in further analysis. At this point, we know the total population
 #size, the names of each unique person. We use this to plot a graph for analysis.
+@timed
 def graph_per_person(person):
-    printcov("Generating graph for: " + person)
+    printcov("Generating graph for: " + person, log_debug)
     one_persons_records = sorteddf.loc[sorteddf['name'] == person] #sorted by time in asc order
     one_persons_records = one_persons_records.reset_index(drop=True)
-    print(one_persons_records)
+    printlog(one_persons_records, log_debug)
     gx = nx.MultiDiGraph(name=person,con=one_persons_records['condition'][0]) #new graph for curr person
 
     #create all nodes
@@ -139,18 +403,18 @@ def graph_per_person(person):
     for index, row in one_persons_records.iterrows():
         #each recorded loc is a node
         nodelabel = str(person) + str(nodeid)
-        gx.add_node(nodelabel,latlon=LatLon(Latitude(row['lat']),Longitude(row['lon'])))
+        gx.add_node(nodelabel,latlon=LatLon(Latitude(row['lat']),Longitude(row['lon'])),time=row['time'])
         nodeid = nodeid+1
     
     noofnodes = nx.number_of_nodes(gx)
 
     #now let's add edges for the nodes
-    print("Adding edges for: " + str(nx.number_of_nodes(gx)) + " nodes...")
-    print(gx.nodes())
+    printlog("Adding edges for: " + str(nx.number_of_nodes(gx)) + " nodes...", log_debug)
+    printlog(gx.nodes(), log_debug)
     for x in range(0,noofnodes):
         y = x + 1
         if(y == noofnodes):
-            print("reached end node")
+            printlog("reached end node", log_debug)
             break
         else:
             nodelabel1 = str(person) + str(x)
@@ -158,125 +422,1393 @@ def graph_per_person(person):
             #gx.add_edge(nodelabel1,nodelabel2,time=one_persons_records.at[nodelabel2,'time'])
             gx.add_edge(nodelabel1,nodelabel2,time=one_persons_records['time'][y])
 
-    print("Completed adding edges for: " + str(person) + ". Graph complete.")
+    printlog("Completed adding edges for: " + str(person) + ". Graph complete.", log_debug)
 
     disp_graph(gx)
     gxarry_pop_travel_hist.append(gx)
 
     return
 
+#builds the trajectory store of the population from the prepp'd data (rows grouped per
+#person and sorted by time, as returned by dataprep). This is a compact replacement for
+#the per person graphs. The store is a dict of flat arrays where person p's readings are
+#the rows offsets[p] to offsets[p+1]:
+# - names, cons: name and condition of each person
+# - offsets: start of each person's readings, plus the total at the end
+# - lat, lon: float64 coordinates of each reading, as recorded
+# - time: int32 minute of the day of each reading
+# - entry, exit: int32 minute of the day the loc was entered / exited. Same as what
+#   find_startime_gx / find_endtime_gx return, 0 when there is no previous / next loc.
+@timed
+def build_trajectory_store(df):
+    names = df['name'].values
+    n = len(names)
+    newperson = np.ones(n, dtype=bool)
+    newperson[1:] = names[1:] != names[:-1]
+    starts = np.flatnonzero(newperson)
+    offsets = np.append(starts, n).astype(np.int64)
+
+    time = hhmm_to_minutes(df['time'].values).astype(np.int32)
+    (entry, exit) = time_windows(time, offsets)
+
+    store = {'names': list(names[starts]), 'cons': list(df['condition'].values[starts]),
+        'offsets': offsets,
+        'lat': df['lat'].values.astype(np.float64), 'lon': df['lon'].values.astype(np.float64),
+        'time': time, 'entry': entry, 'exit': exit}
+    printcov("Trajectory store built for " + str(len(starts)) + " people and " + str(n) + " readings.")
+    return store
+
+#returns the entry and exit minutes of readings given their times and the offsets of each
+#person's readings (see build_trajectory_store)
+def time_windows(time, offsets):
+    entry = time.copy()
+    exit = np.zeros(len(time), dtype=np.int32)
+    exit[:-1] = time[1:]
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]
+    entry[starts] = 0
+    exit[offsets[1:][offsets[:-1] < offsets[1:]] - 1] = 0
+    return entry, exit
+
+#builds a trajectory store from per person graphs (see graph_per_person). The graphs
+#do not hold the time of a person's first loc so it is 0 in the store.
+def store_from_graphs(gxall):
+    names = []
+    cons = []
+    lengths = []
+    lat = []
+    lon = []
+    entry = []
+    exit = []
+    for gx in gxall:
+        name = str(gx.graph['name'])
+        latlons = nx.get_node_attributes(gx,'latlon')
+        names.append(gx.graph['name'])
+        cons.append(gx.graph['con'])
+        lengths.append(len(gx))
+        for n in range(0, len(gx)):
+            (nlat, nlon) = latlon_to_floats(latlons[name + str(n)])
+            lat.append(nlat)
+            lon.append(nlon)
+            entry.append(find_startime_gx(n, gx, name))
+            exit.append(find_endtime_gx(n, gx, name))
+    entry = hhmm_to_minutes(entry).astype(np.int32)
+    return {'names': names, 'cons': cons,
+        'offsets': np.append(0, np.cumsum(lengths)).astype(np.int64),
+        'lat': np.array(lat, dtype=np.float64), 'lon': np.array(lon, dtype=np.float64),
+        'time': entry, 'entry': entry, 'exit': hhmm_to_minutes(exit).astype(np.int32)}
+
+#returns the trajectory store of the given population, which is either a store already
+#or a list of per person graphs
+def as_store(pop):
+    if(isinstance(pop, dict)):
+        return pop
+    return store_from_graphs(pop)
+
+#returns the number of people in a trajectory store
+def store_size(store):
+    return len(store['names'])
+
+#returns the index in a store's columns of the given node numbers of the given people (arrays
+#of person indices and node numbers). Works on trajectory stores and on the store of a trace
+#state (see trace_store).
+def reading_index(store, person, node):
+    person = np.asarray(person, dtype=np.int64)
+    node = np.asarray(node, dtype=np.int64)
+    if('base' not in store):
+        return store['offsets'][person] + node
+    base = store['base']
+    idx = np.full(len(person), -1, dtype=np.int64)
+    inbase = person < len(base) - 1
+    inbase[inbase] = node[inbase] < base[person[inbase] + 1] - base[person[inbase]]
+    idx[inbase] = base[person[inbase]] + node[inbase]
+    rest = np.flatnonzero(~inbase)
+    (which, found) = find_sorted_runs(store['later'], person[rest] * (2 ** 32) + node[rest])
+    idx[rest[which]] = found
+    return idx
+
+#returns person p's trajectory from the store as a dict of person, name, con and the lat, lon,
+#entry and exit arrays of their readings. The arrays are views into the store.
+def person_trajectory(store, p):
+    s = store['offsets'][p]
+    e = store['offsets'][p + 1]
+    return {'person': p, 'name': store['names'][p], 'con': store['cons'][p],
+        'lat': store['lat'][s:e], 'lon': store['lon'][s:e],
+        'entry': store['entry'][s:e], 'exit': store['exit'][s:e]}
+
+#returns the trajectory of one person given either their trajectory or their graph
+def as_trajectory(g):
+    if(isinstance(g, dict)):
+        return g
+    return person_trajectory(store_from_graphs([g]), 0)
+
+#converts times recorded as HHMM (e.g. 1816) to minutes of the day. Works on
+#single values as well as arrays.
+def hhmm_to_minutes(t):
+    t = np.asarray(t, dtype=np.int64)
+    if(np.any(t % 100 >= 60)):
+        raise ValueError("Times must be recorded as HHMM, found minutes over 59.")
+    return (t // 100) * 60 + t % 100
+
+#converts minutes of the day back to HHMM times as recorded in the data
+def minutes_to_hhmm(m):
+    m = np.asarray(m, dtype=np.int64)
+    return (m // 60) * 100 + m % 60
+
+#returns the loc of each reading of a trajectory formatted the same way as LatLon
+def latlon_strings(traj):
+    return [str(LatLon(Latitude(float(traj['lat'][n])),Longitude(float(traj['lon'][n]))))
+        for n in range(0, len(traj['lat']))]
+
 #finds overlapping locations with time for the population and also marks such
 #locations with a new attribute so that we can easily analyze them later. We also
 #create a new undirected graph that has all overlaps available. There shall be one
-#such overlap graph per person in the population.
+#such overlap graph per person in the population. The population is a trajectory
+#store or a list of per person graphs.
+@timed
 def overlaps_for_pop(gxall):
     printcov("Finding overlaps within population's location history")
-    b_all = pd.DataFrame(columns = col_breach)
-    for x in range(0, len(gxall)):
-        #get the 1st person and find overlaps of each of their loc
-        #with each loc of each other person in the population.
-        
-        #we convert the graph to an undirected copy since mixed graphs are
-        #not possible in nx. We'll use both versions for later analysis. Note
-        #that the loc overlap calc doesnt need undirected graph. We shall create
-        #a new undirected edge for each overlap and that is why we need to
-        #convert to undirected graph
-        undirectedgxcurr = gxall[x].to_undirected() #get this person's graph
-        
-        #compare current person graph with all others for loc overlaps
-        #first copy out the graph container
-        gxallminuscurr = []
-        for cv in range(0,len(gxall)):
-            newgx = deepcopy(gxall[cv]) #use a deep copy
-            gxallminuscurr.append(newgx)
-
-        gxallminuscurr.pop(x)#remove current persons graph before cmp
-        for y in range(0, len(gxallminuscurr)):
-            undirectedgxnext = gxallminuscurr[y].to_undirected()
-            disp_graph(undirectedgxnext)
-            bxy = find_overlap(undirectedgxcurr,undirectedgxnext)
-            b_all = b_all.append(bxy)
-            
+    store = as_store(gxall)
+    b_all = new_travel_hist(store['names'], store['cons'])
+
+    spindex = None
+    if(spatial_index == 1):
+        spindex = build_spatial_index(store)
+
+    tindex = None
+    if(time_sweep == 1):
+        tindex = build_time_index(store)
+
+    #(B, A) rows mirrored from the overlaps of (A, B), kept until B's turn when comparing
+    #unordered pairs only
+    mirrored = {}
+
+    for (x, rows) in overlaps_by_anchor(store, spindex, tindex):
+        if(graph_backend == 0):
+            mark_breaches(biggx, rows, store['names'], store['cons'])
+        if(symmetric_pairs == 1 and mirror_travel_hist == 1):
+            #already compared as (y, x), only the travel history rows are needed
+            for part in mirrored.pop(x, []):
+                append_travel_hist(b_all, part)
+            byx = mirror_overlap(rows)
+            bounds = np.flatnonzero(byx['person1'][1:] != byx['person1'][:-1]) + 1
+            for (s, e) in zip(np.append(0, bounds), np.append(bounds, len(byx['person1']))):
+                if(e > s):
+                    mirrored.setdefault(int(byx['person1'][s]), []).append(
+                        dict((c, byx[c][s:e]) for c in byx))
+        append_travel_hist(b_all, rows)
+
     printcov("Completed overlap extractions.")
     return b_all
 
-#finds overlapping locations between two graphs
-def find_overlap(undgx_curr, undgx_next):
+#yields the people of the population to compare with anchor person x, in travel history
+#order, as (comparison person, loc pairs to compare). With symmetric_pairs = 1 only the
+#people after x are compared, the rows of the others are mirrored (see overlaps_for_pop).
+def overlap_plan(store, spindex, tindex, x):
+    offsets = store['offsets']
+
+    #nearby loc pairs of this person with every other person. None = compare all pairs.
+    #With the spatial index only the people with nearby locs are compared at all.
+    cands = None
+    others = range(0, store_size(store))
+    if(spindex is not None):
+        cands = find_candidate_pairs(spindex, x)
+        others = sorted(cands)
+    #with the time sweep only the people with time overlapping locs are
+    if(tindex is not None):
+        cands = find_time_overlap_pairs(tindex, store, x, cands)
+        others = sorted(cands)
+
+    #compare current person with all others for loc overlaps
+    for y in others:
+        if(y == x or (symmetric_pairs == 1 and y < x)):
+            continue
+        nodepairs = None
+        if(cands is not None):
+            nodepairs = cands.get(y, [])
+        if(nodepairs is None):
+            nodepairs = [(n, m) for n in range(0, offsets[x + 1] - offsets[x])
+                for m in range(0, offsets[y + 1] - offsets[y])]
+        yield (y, nodepairs)
+
+#finds the overlaps of anchor person x with everyone in their plan (see overlap_plan).
+#Returns the travel history rows of x as a dict of column arrays, nothing is marked on
+#the graph. Only breach rows are returned if travel_hist_breach_only is set.
+def overlaps_of_anchor(store, spindex, tindex, x):
+    traj = person_trajectory(store, x)
+    rows = concat_travel_rows([overlap_rows(traj, person_trajectory(store, y), nodepairs)
+        for (y, nodepairs) in overlap_plan(store, spindex, tindex, x)])
+    if(travel_hist_breach_only == 1):
+        keep = np.flatnonzero(rows['breach'])
+        rows = dict((c, rows[c][keep]) for c in rows)
+    return rows
+
+#yields (anchor person, travel history rows) for every person of the population in
+#order (see overlaps_of_anchor). With overlap_workers > 1 the anchors are spread over a
+#process pool, overlap_chunksize people per task. Workers plan and compare their anchors
+#from the trajectory store and the indices they inherit and only send back the rows. A
+#window of tasks at a time keeps finished rows from piling up in memory and the counters
+#of the workers are added to the ones of this run.
+def overlaps_by_anchor(store, spindex, tindex):
+    if(overlap_workers <= 1):
+        for x in range(0, store_size(store)):
+            yield (x, overlaps_of_anchor(store, spindex, tindex, x))
+        return
+
+    printcov("Finding overlaps with " + str(overlap_workers) + " worker processes.")
+    tasks = [(x, min(x + overlap_chunksize, store_size(store)))
+        for x in range(0, store_size(store), overlap_chunksize)]
+    pool = multiprocessing.Pool(overlap_workers, initializer=init_overlap_worker,
+        initargs=(store, spindex, tindex))
+    try:
+        window = 2 * overlap_workers
+        for w in range(0, len(tasks), window):
+            for (first, results, counts) in pool.imap(overlap_task, tasks[w:w + window]):
+                for c in counts:
+                    add_count(c, counts[c])
+                for k in range(0, len(results)):
+                    yield (first + k, results[k])
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+#sets up a worker process of the overlap phase with the trajectory store, the spatial
+#index and the time index. With fork they are inherited from the parent as is and
+#never pickled.
+def init_overlap_worker(store, spindex, tindex):
+    global worker_overlap
+    worker_overlap = {'store': store, 'spindex': spindex, 'tindex': tindex}
+
+#finds the overlaps of anchors first to last - 1 inside a worker process. Returns first,
+#the rows of every anchor and the counters of the task.
+def overlap_task(task):
+    (first, last) = task
+    before = dict(run_counters)
+    results = [overlaps_of_anchor(worker_overlap['store'], worker_overlap['spindex'],
+        worker_overlap['tindex'], x) for x in range(first, last)]
+    counts = dict((c, run_counters[c] - before.get(c, 0)) for c in run_counters)
+    return first, results, counts
+
+#compares the given (anchor node, comparison node) loc pairs of two trajectories.
+#Returns the distance and the entry / exit minutes of both locs for every pair, as
+#arrays in nodepairs order.
+def compare_locs(traj1, traj2, nodepairs):
+    ix = np.array([pr[0] for pr in nodepairs], dtype=np.intp)
+    iy = np.array([pr[1] for pr in nodepairs], dtype=np.intp)
+    dists = find_distances(traj1['lat'][ix], traj1['lon'][ix], traj2['lat'][iy], traj2['lon'][iy])
+    return (dists, traj1['entry'][ix], traj1['exit'][ix], traj2['entry'][iy], traj2['exit'][iy])
+
+#turns the overlaps of (A, B) into the overlaps of (B, A). Columns of the two people are
+#swapped and rows are reordered as if B's locs had been compared with A's. Works on the
+#rows of A with several people too, the (B, A) rows come out by B.
+def mirror_overlap(bxy):
+    byx = {}
+    for c in bxy:
+        if(c.endswith('1')):
+            byx[c[:-1] + '2'] = bxy[c]
+        elif(c.endswith('2')):
+            byx[c[:-1] + '1'] = bxy[c]
+        else:
+            byx[c] = bxy[c]
+    order = np.lexsort((byx['node2'], byx['node1'], byx['person1']))
+    return dict((c, byx[c][order]) for c in byx)
+
+#returns an empty travel history for a population with the given names and conditions.
+#Rows are held in preallocated typed column buffers (see col_travel_hist) that grow as
+#rows are added, instead of a DataFrame appended to one row at a time.
+def new_travel_hist(names, cons, capacity=1024):
+    return {'names': names, 'cons': cons, 'n': 0,
+        'cols': dict((c, np.empty(capacity, dtype=t)) for (c, t) in col_travel_hist)}
+
+#joins travel history rows given as dicts of column arrays, in order
+def concat_travel_rows(parts):
+    if(len(parts) == 0):
+        return dict((c, np.empty(0, dtype=t)) for (c, t) in col_travel_hist)
+    return dict((c, np.concatenate([part[c] for part in parts]).astype(t, copy=False))
+        for (c, t) in col_travel_hist)
+
+#appends rows, given as a dict of column arrays, to a travel history. Only breach rows
+#are kept if travel_hist_breach_only is set.
+def append_travel_hist(hist, rows):
+    if(travel_hist_breach_only == 1):
+        keep = np.flatnonzero(rows['breach'])
+        rows = dict((c, rows[c][keep]) for c in rows)
+    n = hist['n']
+    add = len(rows['breach'])
+    cols = hist['cols']
+    capacity = len(cols['breach'])
+    if(n + add > capacity):
+        capacity = max(n + add, 2 * capacity)
+        for (c, t) in col_travel_hist:
+            grown = np.empty(capacity, dtype=t)
+            grown[:n] = cols[c][:n]
+            cols[c] = grown
+    for (c, t) in col_travel_hist:
+        cols[c][n:n + add] = rows[c]
+    hist['n'] = n + add
+
+#returns the number of rows of a travel history
+def travel_hist_size(hist):
+    return hist['n']
+
+#returns rows start to stop of a travel history as a DataFrame in the travelhist_df.csv
+#layout (see col_breach). Builds text columns so keep to a slice for big histories.
+def travel_hist_frame(hist, start=0, stop=None):
+    if(stop is None or stop > hist['n']):
+        stop = hist['n']
+    start = min(start, stop)
+    cols = dict((c, hist['cols'][c][start:stop]) for c in hist['cols'])
+    names = np.array(hist['names'], dtype=object)
+    cons = np.array(hist['cons'], dtype=object)
+    return pd.DataFrame({'name1': names[cols['person1']], 'con1': cons[cols['person1']],
+        'latlon1': latlon_strings({'lat': cols['lat1'], 'lon': cols['lon1']}),
+        'entrytm1': minutes_to_hhmm(cols['entry1']), 'exittm1': minutes_to_hhmm(cols['exit1']),
+        'name2': names[cols['person2']], 'con2': cons[cols['person2']],
+        'latlon2': latlon_strings({'lat': cols['lat2'], 'lon': cols['lon2']}),
+        'entrytm2': minutes_to_hhmm(cols['entry2']), 'exittm2': minutes_to_hhmm(cols['exit2']),
+        'dist': cols['dist'], 'breach': np.where(cols['breach'], 'yes', 'no'),
+        'risk': np.where(cols['high'], 'high', 'none')},
+        columns=col_breach, index=np.zeros(stop - start, dtype=np.int64))
+
+#saves a travel history as filename + '.csv' or '.npz' depending on travel_hist_format.
+#The npz holds one compressed array per column of col_travel_hist plus the names and
+#cons of the population. Returns the path written.
+def save_travel_hist(hist, filename):
+    if(travel_hist_format == 0):
+        path = filename + '.csv'
+        travel_hist_frame(hist).to_csv(path)
+    else:
+        path = filename + '.npz'
+        write_travel_hist_npz(hist, path)
+    printcov("Saved " + str(hist['n']) + " travel histories to: " + path)
+    return path
+
+#writes a travel history to path as compressed npz, see save_travel_hist
+def write_travel_hist_npz(hist, path):
+    cols = dict((c, hist['cols'][c][:hist['n']]) for c in hist['cols'])
+    np.savez_compressed(path, names=np.array(hist['names']), cons=np.array(hist['cons']), **cols)
+
+#writes the rows of a travel history as part number part of the folder path, compressed
+#npz columns without the names and cons of the population (see write_travel_hist_people)
+def write_travel_hist_part(hist, path, part):
+    cols = dict((c, hist['cols'][c][:hist['n']]) for c in hist['cols'])
+    np.savez_compressed(os.path.join(path, "part-%06d.npz" % part), **cols)
+
+#writes the names and cons of the population of a travel history written in parts
+def write_travel_hist_people(hist, path):
+    np.savez_compressed(os.path.join(path, 'people.npz'), names=np.array(hist['names']),
+        cons=np.array(hist['cons']))
+
+#loads a travel history saved as npz by save_travel_hist, or a folder of parts written by
+#the streaming ingest (see write_travel_hist_part)
+def read_travel_hist(path):
+    if(not os.path.isdir(path)):
+        data = np.load(path)
+        cols = dict((c, data[c]) for (c, t) in col_travel_hist)
+        return {'names': data['names'].tolist(), 'cons': data['cons'].tolist(),
+            'n': len(cols['breach']), 'cols': cols}
+
+    data = np.load(os.path.join(path, 'people.npz'))
+    parts = [np.load(os.path.join(path, f)) for f in sorted(os.listdir(path)) if f.startswith('part-')]
+    cols = dict((c, np.concatenate([np.empty(0, dtype=t)] + [part[c] for part in parts]).astype(t))
+        for (c, t) in col_travel_hist)
+    return {'names': data['names'].tolist(), 'cons': data['cons'].tolist(),
+        'n': len(cols['breach']), 'cols': cols}
+
+#merges the breaches of a travel history into co-location episodes per pair of people. Two
+#people are together at a breached loc pair from the later of the times they got there (the
+#time of the reading, kept in the store) to the earlier of the times they left. Breaches of
+#the same two people are sorted by time and merged while they overlap or touch, in one pass.
+#Returns the episodes as a dict of column arrays, by pair and start: person1 < person2,
+#start and end minute of the day, minutes together and closest distance in km.
+@timed
+def find_exposures(hist, store):
+    cols = hist['cols']
+    n = hist['n']
+    i1 = reading_index(store, cols['person1'][:n], cols['node1'][:n])
+    i2 = reading_index(store, cols['person2'][:n], cols['node2'][:n])
+    start = np.maximum(store['time'][i1], store['time'][i2])
+    end = np.minimum(store['exit'][i1], store['exit'][i2])
+    rows = np.flatnonzero(cols['breach'][:n] & (start <= end))
+    p1 = np.minimum(cols['person1'][rows], cols['person2'][rows])
+    p2 = np.maximum(cols['person1'][rows], cols['person2'][rows])
+    order = np.lexsort((start[rows], p2, p1))
+    (p1, p2, start, end, dist) = (p1[order], p2[order], start[rows][order],
+        end[rows][order], cols['dist'][rows][order])
+    if(len(rows) == 0):
+        return {'person1': p1, 'person2': p2, 'start': start, 'end': end,
+            'minutes': end - start, 'min_dist': dist}
+
+    newpair = np.ones(len(p1), dtype=bool)
+    newpair[1:] = (p1[1:] != p1[:-1]) | (p2[1:] != p2[:-1])
+    #latest end so far. Shifting each pair by a day keeps earlier pairs out of it.
+    shift = (np.cumsum(newpair) - 1).astype(np.int64) * (24 * 60 + 1)
+    reach = np.maximum.accumulate(end + shift)
+    newepisode = newpair.copy()
+    newepisode[1:] |= start[1:] + shift[1:] > reach[:-1]
+    firsts = np.flatnonzero(newepisode)
+    epend = np.maximum.reduceat(end, firsts)
+    return {'person1': p1[firsts], 'person2': p2[firsts], 'start': start[firsts], 'end': epend,
+        'minutes': epend - start[firsts], 'min_dist': np.minimum.reduceat(dist, firsts)}
+
+#ranks the pairs of people of exposure episodes (see find_exposures) by their total minutes
+#together, then by how close they got. Returns a DataFrame of one row per pair.
+@timed
+def rank_exposures(episodes, store):
+    df = pd.DataFrame(episodes)
+    pairs = df.groupby(['person1', 'person2'], sort=False).agg({'start': 'min', 'end': 'max',
+        'minutes': ['count', 'sum'], 'min_dist': 'min'})
+    pairs.columns = ['first', 'last', 'episodes', 'minutes', 'min_dist']
+    pairs = pairs.reset_index().sort_values(by=['minutes', 'min_dist'], ascending=[False, True],
+        kind='mergesort')
+    names = np.array(store['names'], dtype=object)
+    cons = np.array(store['cons'], dtype=object)
+    p1 = pairs['person1'].values.astype(np.int64)
+    p2 = pairs['person2'].values.astype(np.int64)
+    ranked = pd.DataFrame({'name1': names[p1], 'con1': cons[p1], 'name2': names[p2], 'con2': cons[p2],
+        'episodes': pairs['episodes'].values, 'minutes': pairs['minutes'].values,
+        'min_dist': pairs['min_dist'].values, 'first': minutes_to_hhmm(pairs['first'].values),
+        'last': minutes_to_hhmm(pairs['last'].values)}, columns=col_exposure)
+    return ranked
+
+#finds and ranks the exposures of a travel history (see find_exposures) and saves the
+#ranking to filename + '.csv'. Returns the ranking.
+def save_exposures(hist, store, filename):
+    ranked = rank_exposures(find_exposures(hist, store), store)
+    printcov("There are : " + str(len(ranked)) + " pairs of people who were together. The most exposed ones are: ")
+    printlog(ranked.head(27))
+    ranked.to_csv(filename + ".csv")
+    printcov("Saved exposures to: " + filename + ".csv")
+    return ranked
+
+#returns the (lat, lon) of a node's 'latlon' attribute as floats in decimal degrees
+def latlon_to_floats(latlon):
+    return (float(latlon.lat.decimal_degree), float(latlon.lon.decimal_degree))
+
+#returns the grid cells that hold the given coordinate arrays as (row, col) arrays.
+#cell_km is the cell width and lon_scale the cos of the highest latitude in the data,
+#which keeps cells wide enough.
+def grid_cells(lat, lon, cell_km, lon_scale):
+    return (np.floor(lat * km_per_deg_lat / cell_km).astype(np.int64),
+        np.floor(lon * km_per_deg_lon_equator * lon_scale / cell_km).astype(np.int64))
+
+#builds a uniform grid over the locations of the whole population. Each cell is at
+#least radius (default microcell_radius) wide so two locs that can breach the microcell
+#are always in the same or adjacent cells. Returns the grid (cell -> list of (person,
+#node) indices) and the cell of every node of every person.
+def build_spatial_index(pop, radius=None):
+    if(radius is None):
+        radius = microcell_radius
+    store = as_store(pop)
+    maxlat = 0.0
+    if(len(store['lat']) > 0):
+        maxlat = float(np.max(np.abs(store['lat'])))
+
+    #1% slack over the radius keeps the per axis distance bounds conservative
+    cell_km = max(radius, 1e-9) * 1.01
+    lon_scale = math.cos(math.radians(min(maxlat, 90.0)))
+    (cy, cx) = grid_cells(store['lat'], store['lon'], cell_km, lon_scale)
+    cells = list(zip(cy.tolist(), cx.tolist()))
+
+    grid = {}
+    nodecells = []
+    offsets = store['offsets']
+    for p in range(0, store_size(store)):
+        pcells = cells[offsets[p]:offsets[p + 1]]
+        for n in range(0, len(pcells)):
+            grid.setdefault(pcells[n], []).append((p, n))
+        nodecells.append(pcells)
+
+    printcov("Spatial index built with " + str(len(grid)) + " cells of " + str(cell_km) + " km.")
+    return grid, nodecells
+
+#finds candidate loc pairs of person x with everyone else using the spatial index. Only
+#locs in the same or adjacent cells can breach the microcell. Returns a dict of other
+#person index -> list of (node of x, node of other) sorted the same way as a full scan.
+def find_candidate_pairs(spindex, x):
+    grid, nodecells = spindex
+    cands = {}
+    for n in range(0, len(nodecells[x])):
+        (cy, cx) = nodecells[x][n]
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for (p, m) in grid.get((cy + dy, cx + dx), []):
+                    if(p != x):
+                        cands.setdefault(p, []).append((n, m))
+    for p in cands:
+        cands[p].sort()
+    return cands
+
+#builds the time index of the population for the time sweep. Readings whose [entry, exit]
+#window can overlap at all (entry <= exit, the last loc of a person has exit 0) are sorted by
+#entry time, so the windows opened by a given minute are a prefix of the index. Returns a
+#dict of the sorted 'entry' minutes, the 'reading' of each and the 'person' of every reading
+#of the store.
+def build_time_index(pop):
+    store = as_store(pop)
+    valid = np.flatnonzero(store['entry'] <= store['exit'])
+    order = valid[np.argsort(store['entry'][valid], kind='mergesort')]
+    counts = np.diff(store['offsets'])
+    printcov("Time index built over " + str(len(order)) + " loc windows.")
+    return {'entry': store['entry'][order], 'reading': order.astype(np.int64),
+        'person': np.repeat(np.arange(len(counts)), counts)}
+
+#finds the loc pairs of anchor person x with everyone else whose time windows intersect,
+#which is exactly the max(entry) <= min(exit) check done in find_overlap. If cands, the
+#spatial index candidates of x (see find_candidate_pairs), are given only they are checked.
+#Otherwise each loc of x is swept over the windows of the time index opened by its exit.
+#Nothing is kept for the rest of the population. Returns a dict like find_candidate_pairs.
+def find_time_overlap_pairs(tindex, store, x, cands=None):
+    offsets = store['offsets']
+    entry = store['entry']
+    exit = store['exit']
+    ia = [np.zeros(0, dtype=np.int64)]
+    ib = [np.zeros(0, dtype=np.int64)]
+    if(cands is None):
+        for i in range(offsets[x], offsets[x + 1]):
+            if(entry[i] > exit[i]):
+                continue
+            opened = tindex['reading'][:np.searchsorted(tindex['entry'], exit[i], side='right')]
+            j = opened[(exit[opened] >= entry[i]) & (tindex['person'][opened] != x)]
+            ia.append(np.full(len(j), i, dtype=np.int64))
+            ib.append(j)
+    else:
+        for p in cands:
+            pairs = np.array(cands[p], dtype=np.int64).reshape(-1, 2)
+            ia.append(offsets[x] + pairs[:, 0])
+            ib.append(offsets[p] + pairs[:, 1])
+    ia = np.concatenate(ia)
+    ib = np.concatenate(ib)
+    if(cands is not None):
+        keep = np.maximum(entry[ia], entry[ib]) <= np.minimum(exit[ia], exit[ib])
+        (ia, ib) = (ia[keep], ib[keep])
+
+    pb = tindex['person'][ib]
+    na = ia - offsets[x]
+    nb = ib - offsets[pb]
+    order = np.lexsort((nb, na, pb))
+    (pb, na, nb) = (pb[order], na[order].tolist(), nb[order].tolist())
+    bounds = np.flatnonzero(pb[1:] != pb[:-1]) + 1
+    tpairs = {}
+    for (s, e) in zip(np.append(0, bounds), np.append(bounds, len(pb))):
+        if(e > s):
+            tpairs[int(pb[s])] = list(zip(na[s:e], nb[s:e]))
+    add_count('time_overlap_pairs', len(pb))
+    return tpairs
+
+#finds overlapping locations between two people, given as trajectories (see
+#person_trajectory) or as graphs, and marks the breaches on biggx. nodepairs optionally
+#restricts the comparison to the given (anchor node, comparison node) index pairs, default
+#is all pairs. Returns the travel history rows of the compared pairs as a dict of column
+#arrays (see col_travel_hist).
+def find_overlap(undgx_curr, undgx_next, nodepairs=None):
+    traj_curr = as_trajectory(undgx_curr)
+    traj_next = as_trajectory(undgx_next)
+    rows = overlap_rows(traj_curr, traj_next, nodepairs)
+
+    #a contact graph gets its breaches from the travel history afterwards
+    if(graph_backend == 0):
+        #rows are marked by person index, the two trajectories are people 0 and 1 here
+        marked = dict(rows)
+        marked['person1'] = np.zeros(len(rows['breach']), dtype=np.int32)
+        marked['person2'] = np.ones(len(rows['breach']), dtype=np.int32)
+        mark_breaches(biggx, marked, [traj_curr['name'], traj_next['name']],
+            [traj_curr['con'], traj_next['con']])
+    return rows
+
+#compares the locs of two trajectories like find_overlap without marking anything. Runs
+#in overlap worker processes too. Returns the travel history rows of the compared pairs.
+def overlap_rows(traj_curr, traj_next, nodepairs=None):
+
     #get 'latlon' attributes of both and figure out if present in microcell
-    anchorgraph_name = str(undgx_curr.graph['name'])
-    compargraph_name = str(undgx_next.graph['name'])
-    anchor_health_status = str(undgx_curr.graph['con'])
-    compar_health_status = str(undgx_next.graph['con'])
-    printcov("Processing overlaps. Anchor graph: " + anchorgraph_name + " | " + 
-        anchor_health_status + " and Comparison graph: " 
-        + compargraph_name + " | " + compar_health_status)
-    gxcurr_nodeattrib = nx.get_node_attributes(undgx_curr,'latlon')
-    gxnext_nodeattrib = nx.get_node_attributes(undgx_next,'latlon')
-    printcov("Node attributes for overlap calc are:\n")
-    print("curr anchor graph: " + str(gxcurr_nodeattrib))
-    print("comparison  graph: " + str(gxnext_nodeattrib))
-    print("\n")
-
-    b = pd.DataFrame(columns = col_breach)
-
-    for x in range(0, len(gxcurr_nodeattrib)):
-        for y in range(0, len(gxnext_nodeattrib)):
-            #here, we compare curr(latlon) with next(latlon) iteratively.
-            gxcurr_curr_nodelbl = str(anchorgraph_name) + str(x)
-            gxnext_curr_nodelbl = str(compargraph_name) + str(y)
-            print(str(gxcurr_nodeattrib[gxcurr_curr_nodelbl]) + " ----- " + str(gxnext_nodeattrib[gxnext_curr_nodelbl]))
-            distance = gxcurr_nodeattrib[gxcurr_curr_nodelbl].distance(gxnext_nodeattrib[gxnext_curr_nodelbl])
+    anchorgraph_name = str(traj_curr['name'])
+    compargraph_name = str(traj_next['name'])
+    anchor_health_status = str(traj_curr['con'])
+    compar_health_status = str(traj_next['con'])
+    if(log_level >= log_debug):
+        printcov("Processing overlaps. Anchor graph: " + anchorgraph_name + " | " + 
+            anchor_health_status + " and Comparison graph: " 
+            + compargraph_name + " | " + compar_health_status, log_debug)
+        gxcurr_nodeattrib = latlon_strings(traj_curr)
+        gxnext_nodeattrib = latlon_strings(traj_next)
+        printcov("Node attributes for overlap calc are:\n", log_debug)
+        print("curr anchor graph: " + str(gxcurr_nodeattrib))
+        print("comparison  graph: " + str(gxnext_nodeattrib))
+        print("\n")
+
+    if(nodepairs is None):
+        nodepairs = [(x, y) for x in range(0, len(traj_curr['lat']))
+            for y in range(0, len(traj_next['lat']))]
+
+    #all distances and times of this pair of people in one go
+    (dists, entm1s, extm1s, entm2s, extm2s) = compare_locs(traj_curr, traj_next, nodepairs)
+    dists = np.asarray(dists, dtype=np.float64)
+    ix = np.array([pr[0] for pr in nodepairs], dtype=np.int32)
+    iy = np.array([pr[1] for pr in nodepairs], dtype=np.int32)
+
+    #here, we compare curr(latlon) with next(latlon) for all loc pairs at once. A breach
+    #is a pair within the microcell. Risk is still none because we have not yet
+    #calculated time overlap.
+    breaches = dists <= microcell_radius
+
+    #time overlaps. use the entry / exit times of both to calculate overlap. If there is
+    #an overlap of time then we have two people in the same location at the same
+    #time => risk == high if one of them is sick. For the h person mark the loc as
+    #infection start time (potentially). We already have the time at that place tho
+    #the actual start time should be the time h and s were together first at this loc.
+    #Minutes of the day are in the same order as the HHMM times of the travel history.
+    overlaps = np.maximum(entm1s, entm2s) <= np.minimum(extm1s, extm2s)
+    highs = breaches & overlaps & (anchor_health_status == 'sick' or compar_health_status == 'sick')
+    add_count('candidate_pairs', len(nodepairs))
+    add_count('breaches', np.count_nonzero(breaches))
+    add_count('high_risk', np.count_nonzero(highs))
+
+    if(log_level >= log_debug):
+        for k in range(0, len(nodepairs)):
+            (x, y) = nodepairs[k]
+            print(gxcurr_nodeattrib[x] + " ----- " + gxnext_nodeattrib[y])
             print("Person: " + anchorgraph_name +  " & Person " + compargraph_name)
-            print("     - anchor node: " + str(gxcurr_curr_nodelbl) + "  and comparison node: " + str(gxnext_curr_nodelbl))
-            print("     - distance between above two: " + str(distance))
-
-            entm1 = find_startime_gx(x, undgx_curr, anchorgraph_name)
-            extm1 = find_endtime_gx(x, undgx_curr, anchorgraph_name)
-
-            entm2 = find_startime_gx(y, undgx_next, compargraph_name)
-            extm2 = find_endtime_gx(y, undgx_next, compargraph_name)
-            
-            risk = 'none'
-            breach = 'no'
-            if(distance <= microcell_radius):
-                
-                #a new edge connecting these two nodes and save the graph. Also mark
-                #the relevant loc's as 'breached' with a new node attribute. risk is still
-                #classified as none because we have not yet calculated time overlap
+            print("     - anchor node: " + anchorgraph_name + str(x) + "  and comparison node: " +
+                compargraph_name + str(y))
+            print("     - distance between above two: " + str(float(dists[k])))
+            if(breaches[k]):
                 print("Microcell radius breached.")
-                breach = 'yes'
-                #breachnodes attribute is useful to find edges that caused a breach
-                biggx.add_edge(gxcurr_curr_nodelbl,gxnext_curr_nodelbl,
-                    breachnodes=(gxcurr_curr_nodelbl+':'+gxnext_curr_nodelbl))
-                biggx.nodes[gxcurr_curr_nodelbl]['breached'] = 'yes'
-                biggx.nodes[gxnext_curr_nodelbl]['breached'] = 'yes'
-
-                #time overlaps. use e*tm1 and e*tm2 to calculate overlap. If there is
-                #an overlap of time then we have two people in the same location at the same
-                #time => risk == high if one of them is sick. For the h person mark the loc as
-                #infection start time (potentially). We already have the time at that place tho
-                #the actual start time should be the time h and s were together first at this loc.
-                #risk = 'high'
-                if(max(entm1,entm2) <= min(extm1,extm2)):
+                if(overlaps[k]):
                     print("Time overlap found too. Checking if one of them is sick..")
-                    if( (anchor_health_status=='sick') or (compar_health_status=='sick')):
+                    if(highs[k]):
                         print("One person is sick. Marked as high risk for healthy.")
-                        risk = 'high'
-                        if(anchor_health_status=='healthy'):
-                          biggx.nodes[gxcurr_curr_nodelbl]['infec_start_loc'] = 'yes'
-                        if(compar_health_status=='healthy'):
-                          biggx.nodes[gxnext_curr_nodelbl]['infec_start_loc'] = 'yes'
-            
-            data = pd.DataFrame([[anchorgraph_name, anchor_health_status, 
-                    gxcurr_nodeattrib[gxcurr_curr_nodelbl], entm1, extm1, 
-                    compargraph_name, compar_health_status,
-                    gxnext_nodeattrib[gxnext_curr_nodelbl], entm2, extm2, 
-                    distance, breach, risk]],
-                    columns=['name1','con1','latlon1','entrytm1','exittm1','name2','con2',
-                        'latlon2','entrytm2','exittm2','dist','breach', 'risk'])
-            b = b.append(data)
-
-    return b
+
+    return {'person1': np.full(len(ix), traj_curr.get('person', 0), dtype=np.int32), 'node1': ix,
+        'lat1': traj_curr['lat'][ix], 'lon1': traj_curr['lon'][ix],
+        'entry1': entm1s, 'exit1': extm1s,
+        'person2': np.full(len(iy), traj_next.get('person', 0), dtype=np.int32), 'node2': iy,
+        'lat2': traj_next['lat'][iy], 'lon2': traj_next['lon'][iy],
+        'entry2': entm2s, 'exit2': extm2s,
+        'dist': dists, 'breach': breaches, 'high': highs}
+
+#marks the breaches of travel history rows on g. For each breach a new edge connects the
+#two nodes (locs) and both are marked as 'breached' with a new node attribute. breachnodes
+#attribute is useful to find edges that caused a breach. For high risk breaches the loc of
+#the healthy person is marked as 'infec_start_loc'. names and cons are those of the people
+#the rows' person1 / person2 index into.
+def mark_breaches(g, rows, names, cons):
+    for k in np.flatnonzero(rows['breach']):
+        (p1, p2) = (rows['person1'][k], rows['person2'][k])
+        gxcurr_curr_nodelbl = str(names[p1]) + str(rows['node1'][k])
+        gxnext_curr_nodelbl = str(names[p2]) + str(rows['node2'][k])
+        g.add_edge(gxcurr_curr_nodelbl,gxnext_curr_nodelbl,
+            breachnodes=(gxcurr_curr_nodelbl+':'+gxnext_curr_nodelbl))
+        g.nodes[gxcurr_curr_nodelbl]['breached'] = 'yes'
+        g.nodes[gxnext_curr_nodelbl]['breached'] = 'yes'
+        if(rows['high'][k]):
+            if(str(cons[p1])=='healthy'):
+              g.nodes[gxcurr_curr_nodelbl]['infec_start_loc'] = 'yes'
+            if(str(cons[p2])=='healthy'):
+              g.nodes[gxnext_curr_nodelbl]['infec_start_loc'] = 'yes'
+
+#haversine distance in km between arrays of coordinates given in decimal degrees. Works
+#element wise and broadcasts like any numpy expression, so one call covers a whole block.
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = np.radians(lon2) - np.radians(lon1)
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    add_count('haversine_evals', np.size(a))
+    return 2.0 * earth_radius_km * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+#returns the LatLon distance in km between two locs given in decimal degrees
+def latlon_distance(lat1, lon1, lat2, lon2):
+    loc1 = LatLon(Latitude(float(lat1)),Longitude(float(lon1)))
+    loc2 = LatLon(Latitude(float(lat2)),Longitude(float(lon2)))
+    add_count('latlon_evals')
+    return loc1.distance(loc2)
+
+#calculates the distance in km between (lat1, lon1) and (lat2, lon2) pairwise. With the
+#haversine kernel all pairs take one call and pairs that are too close to microcell_radius
+#to be decided by haversine are recalculated with LatLon so breaches are exact.
+def find_distances(lat1, lon1, lat2, lon2):
+    if(distance_kernel == 1):
+        dists = haversine_km(lat1, lon1, lat2, lon2)
+        recalc = np.nonzero(np.abs(dists - microcell_radius) <= distance_kernel_rtol * microcell_radius)[0]
+    else:
+        dists = np.zeros(len(lat1))
+        recalc = range(0, len(lat1))
+    for k in recalc:
+        dists[k] = latlon_distance(lat1[k], lon1[k], lat2[k], lon2[k])
+    return dists
+
+#tolerance test of the haversine kernel against LatLon distances on the loaded data. All
+#loc pairs of the first maxppl people are compared and an error is raised if any of them
+#differs by more than distance_kernel_rtol.
+@timed
+def check_distance_kernel(pop, maxppl=5):
+    printcov("Checking distance kernel against LatLon distances.")
+    store = as_store(pop)
+    sample = [person_trajectory(store, p) for p in range(0, min(maxppl, store_size(store)))]
+    worst = 0.0
+    for traj1 in sample:
+        for traj2 in sample:
+            kdists = haversine_km(traj1['lat'][:, None], traj1['lon'][:, None],
+                traj2['lat'][None, :], traj2['lon'][None, :])
+            for x in range(0, len(traj1['lat'])):
+                for y in range(0, len(traj2['lat'])):
+                    ldist = latlon_distance(traj1['lat'][x], traj1['lon'][x],
+                        traj2['lat'][y], traj2['lon'][y])
+                    err = abs(kdists[x][y] - ldist)
+                    if(err > distance_kernel_rtol * ldist + 1e-12):
+                        raise ValueError("Distance kernel out of tolerance: " + str(kdists[x][y]) +
+                            " vs LatLon " + str(ldist))
+                    if(ldist > 0):
+                        worst = max(worst, err / ldist)
+    printcov("Distance kernel within tolerance. Worst relative error: " + str(worst))
+    return worst
+
+#finds every loc pair of two different people of the population that may be within
+#max_radius of each other, each unordered pair once, with the spatial index. This is
+#the overlap phase without the graph and the travel history, so its result can be
+#thresholded at any radius up to max_radius (see classify_pairs). Returns a dict of
+#arrays: person1, node1, person2, node2 with person1 < person2, their distance
+#(haversine with distance_kernel = 1, LatLon otherwise) and whether their [entry, exit]
+#windows overlap in time.
+@timed
+def find_pair_distances(pop, max_radius):
+    store = as_store(pop)
+    spindex = build_spatial_index(store, max_radius)
+    p1 = []
+    n1 = []
+    p2 = []
+    n2 = []
+    for x in range(0, store_size(store)):
+        cands = find_candidate_pairs(spindex, x)
+        for y in sorted(cands):
+            if(y < x):
+                continue
+            p1.extend([x] * len(cands[y]))
+            p2.extend([y] * len(cands[y]))
+            n1.extend([pr[0] for pr in cands[y]])
+            n2.extend([pr[1] for pr in cands[y]])
+
+    pairs = {'person1': np.array(p1, dtype=np.int32), 'node1': np.array(n1, dtype=np.int32),
+        'person2': np.array(p2, dtype=np.int32), 'node2': np.array(n2, dtype=np.int32)}
+    i1 = store['offsets'][pairs['person1']] + pairs['node1']
+    i2 = store['offsets'][pairs['person2']] + pairs['node2']
+    if(distance_kernel == 1):
+        pairs['dist'] = haversine_km(store['lat'][i1], store['lon'][i1], store['lat'][i2], store['lon'][i2])
+    else:
+        pairs['dist'] = np.array([latlon_distance(store['lat'][a], store['lon'][a],
+            store['lat'][b], store['lon'][b]) for (a, b) in zip(i1, i2)], dtype=np.float64)
+    pairs['overlap'] = (np.maximum(store['entry'][i1], store['entry'][i2]) <=
+        np.minimum(store['exit'][i1], store['exit'][i2]))
+    add_count('candidate_pairs', len(i1))
+    printcov("Found " + str(len(i1)) + " candidate loc pairs for radii up to " + str(max_radius) + " km.")
+    return pairs
+
+#returns the distances of the pairs found by find_pair_distances as they are decided at
+#the given radius. Haversine distances too close to the radius to be decided are rechecked
+#with LatLon like find_distances does, so breaches are the same as a run at that radius.
+def radius_distances(pairs, pop, radius):
+    store = as_store(pop)
+    dists = pairs['dist']
+    if(distance_kernel == 1):
+        recheck = np.flatnonzero(np.abs(dists - radius) <= distance_kernel_rtol * radius)
+        if(len(recheck) > 0):
+            dists = dists.copy()
+            i1 = store['offsets'][pairs['person1'][recheck]] + pairs['node1'][recheck]
+            i2 = store['offsets'][pairs['person2'][recheck]] + pairs['node2'][recheck]
+            for (k, a, b) in zip(recheck, i1, i2):
+                dists[k] = latlon_distance(store['lat'][a], store['lon'][a], store['lat'][b], store['lon'][b])
+    return dists
+
+#classifies the pairs found by find_pair_distances at the given radius the same way
+#find_overlap does. Returns their distances (see radius_distances), whether they breach
+#the microcell and whether they are high risk, i.e. a breach that overlaps in time where
+#one of the two people is sick.
+@timed
+def classify_pairs(pairs, pop, radius):
+    store = as_store(pop)
+    sick = np.array(store['cons']) == 'sick'
+    dists = radius_distances(pairs, store, radius)
+    breach = dists <= radius
+    high = breach & pairs['overlap'] & (sick[pairs['person1']] | sick[pairs['person2']])
+    add_count('breaches', np.count_nonzero(breach))
+    add_count('high_risk', np.count_nonzero(high))
+    return dists, breach, high
+
+#marks classified pairs (see classify_pairs) on g the same way find_overlap does. With
+#symmetric_pairs = 0 every breach edge is added in both directions like a full run does.
+def mark_pair_breaches(g, pairs, pop, breach, high):
+    store = as_store(pop)
+    for k in np.flatnonzero(breach):
+        p1 = pairs['person1'][k]
+        p2 = pairs['person2'][k]
+        lbl1 = str(store['names'][p1]) + str(pairs['node1'][k])
+        lbl2 = str(store['names'][p2]) + str(pairs['node2'][k])
+        g.add_edge(lbl1, lbl2, breachnodes=(lbl1 + ':' + lbl2))
+        if(symmetric_pairs == 0):
+            g.add_edge(lbl2, lbl1, breachnodes=(lbl2 + ':' + lbl1))
+        g.nodes[lbl1]['breached'] = 'yes'
+        g.nodes[lbl2]['breached'] = 'yes'
+        if(high[k]):
+            if(store['cons'][p1] == 'healthy'):
+                g.nodes[lbl1]['infec_start_loc'] = 'yes'
+            if(store['cons'][p2] == 'healthy'):
+                g.nodes[lbl2]['infec_start_loc'] = 'yes'
+
+#returns the travel history of classified pairs (see classify_pairs). Each pair is in it
+#once, as (person1, person2).
+def pair_travel_hist(pairs, pop, dists, breach, high):
+    store = as_store(pop)
+    hist = new_travel_hist(store['names'], store['cons'], max(1, len(dists)))
+    rows = {'dist': dists, 'breach': breach, 'high': high}
+    for c in ('1', '2'):
+        i = store['offsets'][pairs['person' + c]] + pairs['node' + c]
+        rows['person' + c] = pairs['person' + c]
+        rows['node' + c] = pairs['node' + c]
+        for f in ('lat', 'lon', 'entry', 'exit'):
+            rows[f + c] = store[f][i]
+    append_travel_hist(hist, rows)
+    return hist
+
+#overlaps for several microcell radii in one pass. Loc pair distances are calculated once
+#for the largest radius (see find_pair_distances), then every radius gets its own graph,
+#travel history and graph analysis, saved with a _mcradius-<radius> suffix. pairs can be
+#given if already found for the largest radius or more. Returns a dict of radius -> results
+#of the graph analysis (see run_graph_analysis) plus the 'breach_pairs' and
+#'high_risk_pairs' found and the 'secs' the radius took.
+@timed
+def overlaps_for_radii(pop, radii, pairs=None):
+    global biggx
+    printcov("Finding overlaps for microcell radii: " + str(sorted(radii)))
+    store = as_store(pop)
+    if(pairs is None):
+        pairs = find_pair_distances(store, max(radii))
+    results = {}
+    for radius in sorted(radii):
+        start = time.time()
+        printcov("Results for microcell radius: " + str(radius))
+        (dists, breach, high) = classify_pairs(pairs, store, radius)
+        biggx = build_bigdaddy(pop)
+        mark_pair_breaches(biggx, pairs, store, breach, high)
+        suffix = "_mcradius-" + str(radius)
+        save_travel_hist(pair_travel_hist(pairs, store, dists, breach, high), "travelhist_df" + suffix)
+        disp_graph(biggx)
+        save_graph_to_pickle(biggx, "graph" + suffix + ".gz")
+        results[radius] = run_graph_analysis(biggx)
+        results[radius].update({'breach_pairs': int(breach.sum()), 'high_risk_pairs': int(high.sum()),
+            'secs': time.time() - start})
+    return results
+
+#builds the state incremental tracing works on (see trace_new_readings) from a trajectory
+#store and the graph of a full run over it (biggx). The state holds a trace store of the
+#readings (see trace_store), the graph, the index of each person by name, a spatial grid of
+#all readings (see index_trace_state) and the changes not saved yet (see save_trace_state).
+#grid is a grid saved with the state, it is rebuilt if not given or if it was built for
+#another microcell radius.
+def new_trace_state(store, g, grid=None):
+    state = trace_state_of_store(store, g)
+    attach_trace_grid(state, grid)
+    return state
+
+#builds a trace state like new_trace_state does, without its spatial grid
+def trace_state_of_store(store, g):
+    maxlat = 0.0
+    if(len(store['lat']) > 0):
+        maxlat = float(np.max(np.abs(store['lat'])))
+    return {'store': trace_store(store), 'graph': g, 'maxlat': maxlat,
+        'people': dict((store['names'][p], p) for p in range(0, store_size(store))),
+        'cell_km': max(microcell_radius, 1e-9) * 1.01, 'delta': new_trace_delta()}
+
+#turns a trajectory store into the store of a trace state. Readings are never moved once in
+#it, new ones are appended to column buffers that grow like the travel history ones, so a
+#batch costs the same whatever the size of the store. It has the names, cons, lat, lon, time,
+#entry and exit of a trajectory store, the columns being views of the first n rows of the
+#buffers, plus:
+# - person, node: the person and node number of every reading
+# - count, last: lists of the number of readings of each person and of their last reading
+# - base: offsets of the store it was built from, its readings are where they were in it
+# - later: sorted runs (see add_sorted_run) of person * 2^32 + node -> reading, for the
+#   readings added since
+# - n, cols: the number of readings and the column buffers
+def trace_store(store):
+    offsets = np.asarray(store['offsets'], dtype=np.int64)
+    counts = np.diff(offsets)
+    person = np.repeat(np.arange(len(counts)), counts)
+    cols = dict((c, np.array(store[c], dtype=t)) for (c, t) in col_trace_store if c in store)
+    cols['person'] = person.astype(np.int64)
+    cols['node'] = np.arange(len(person), dtype=np.int64) - np.repeat(offsets[:-1], counts)
+    tstore = {'names': list(store['names']), 'cons': list(store['cons']), 'n': len(person),
+        'cols': cols, 'count': counts.tolist(), 'last': (offsets[1:] - 1).tolist(),
+        'base': offsets, 'later': []}
+    trace_store_views(tstore)
+    return tstore
+
+#points the columns of a trace store at the first n rows of its buffers
+def trace_store_views(store):
+    for c in store['cols']:
+        store[c] = store['cols'][c][:store['n']]
+
+#writes values after the first n entries of a buffer. Returns the buffer, or a new one of
+#twice the capacity if it was full, so appending costs O(len(values)) amortized.
+def append_buffer(buf, n, values):
+    if(n + len(values) > len(buf)):
+        grown = np.empty(max(n + len(values), 2 * len(buf)), dtype=buf.dtype)
+        grown[:n] = buf[:n]
+        buf = grown
+    buf[n:n + len(values)] = values
+    return buf
+
+#adds entries, given as arrays of keys and values, to sorted runs: a list of (keys, values)
+#arrays each sorted by key. The entries make a run of their own and the last two runs are
+#merged while the one before is not bigger, so there are O(log n) runs and adding entries
+#costs O(entries log n) amortized whatever is in the runs already.
+def add_sorted_run(runs, keys, values):
+    order = np.argsort(keys, kind='mergesort')
+    runs.append((keys[order], values[order]))
+    while(len(runs) > 1 and len(runs[-2][0]) <= len(runs[-1][0])):
+        (keys2, values2) = runs.pop()
+        (keys1, values1) = runs.pop()
+        keys = np.concatenate((keys1, keys2))
+        order = np.argsort(keys, kind='mergesort')
+        runs.append((keys[order], np.concatenate((values1, values2))[order]))
+
+#returns the entries of sorted runs whose key is one of keys, as arrays of (index into keys,
+#value) ordered by index into keys
+def find_sorted_runs(runs, keys):
+    which = [np.zeros(0, dtype=np.int64)]
+    found = [np.zeros(0, dtype=np.int64)]
+    for (rkeys, rvalues) in runs:
+        lo = np.searchsorted(rkeys, keys, side='left')
+        counts = np.searchsorted(rkeys, keys, side='right') - lo
+        which.append(np.repeat(np.arange(len(keys)), counts))
+        found.append(rvalues[np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())])
+    which = np.concatenate(which)
+    order = np.argsort(which, kind='mergesort')
+    return which[order], np.concatenate(found)[order]
+
+#returns the changes of a trace state not saved yet: batches of new readings as (names and
+#cons of new people, readings), condition changes by person and changes to the graph
+def new_trace_delta():
+    return {'batches': [], 'cons': {}, 'graph': []}
+
+#returns the keys of grid cells (see grid_cells) in the spatial grid of a trace state.
+#Keys sort the same way as (row, col).
+def trace_cell_keys(cy, cx):
+    return cy.astype(np.int64) * (2 ** 32) + (cx.astype(np.int64) + 2 ** 31)
+
+#sets the spatial grid of a trace state to a grid saved with it (see save_trace_state),
+#adding the readings that came after it was saved. The grid is rebuilt if there is none or
+#it was built for another microcell radius or a lower latitude.
+def attach_trace_grid(state, grid=None):
+    n = state['store']['n']
+    if(grid is not None and 'reading' in grid and float(grid['cell_km']) == state['cell_km'] and
+            float(grid['maxlat']) >= state['maxlat'] and len(grid['keys']) <= n):
+        state['maxlat'] = float(grid['maxlat'])
+        state['lon_scale'] = math.cos(math.radians(min(state['maxlat'], 90.0)))
+        state['grid'] = [(grid['keys'], grid['reading'].astype(np.int64))]
+        state['grid_saved'] = True
+        if(len(grid['keys']) < n):
+            grow_trace_grid(state, np.arange(len(grid['keys']), n))
+    else:
+        index_trace_state(state)
+
+#(re)builds the spatial grid of a trace state over all of its readings. The grid is sorted
+#runs (see add_sorted_run) of the key of a reading's cell (see trace_cell_keys) -> reading,
+#so the readings of a cell are found with binary searches and new readings are added as a
+#run without going through the old ones.
+def index_trace_state(state):
+    state['lon_scale'] = math.cos(math.radians(min(state['maxlat'], 90.0)))
+    state['grid'] = []
+    state['grid_saved'] = False
+    grow_trace_grid(state, np.arange(state['store']['n']))
+
+#adds readings, given as an array of their indices in the store, to the grid of a trace state
+def grow_trace_grid(state, readings):
+    store = state['store']
+    (cy, cx) = grid_cells(store['lat'][readings], store['lon'][readings], state['cell_km'], state['lon_scale'])
+    add_sorted_run(state['grid'], trace_cell_keys(cy, cx), readings.astype(np.int64))
+
+#returns the readings in the cells around each of the given locs of a trace state, as
+#arrays of (index of the loc, reading) ordered by loc
+def trace_state_neighbours(state, lat, lon):
+    (cy, cx) = grid_cells(lat, lon, state['cell_km'], state['lon_scale'])
+    keys = np.column_stack([trace_cell_keys(cy + dy, cx + dx)
+        for dy in (-1, 0, 1) for dx in (-1, 0, 1)]).ravel()
+    (which, readings) = find_sorted_runs(state['grid'], keys)
+    return which // 9, readings
+
+#returns whether each of the given people (an array of person indices) is sick. Only the
+#conditions of the people given are looked at.
+def sick_people(cons, people):
+    (uniq, inv) = np.unique(people, return_inverse=True)
+    return np.array([cons[p] == 'sick' for p in uniq], dtype=bool)[inv.ravel()]
+
+#appends new people, given as lists of names and cons, and their readings to the store of a
+#trace state. readings is a dict of arrays of person, node, lat, lon and minute time (see
+#col_trace_readings), each person's readings together and in node order. The entry / exit
+#minutes of the new readings and the exit of each person's previous last reading are set
+#the same way time_windows does. Only the grid (if the state has one yet) is updated besides
+#the store. Returns the indices of the new readings and of the previous last readings.
+def add_trace_readings(state, names, cons, readings):
+    store = state['store']
+    for k in range(0, len(names)):
+        state['people'][names[k]] = len(store['names'])
+        store['names'].append(names[k])
+        store['cons'].append(cons[k])
+        store['count'].append(0)
+        store['last'].append(-1)
+
+    n = store['n']
+    person = readings['person']
+    newperson = np.ones(len(person), dtype=bool)
+    newperson[1:] = person[1:] != person[:-1]
+    starts = np.flatnonzero(newperson)
+    ends = np.append(starts[1:], len(person))
+    (entry, exit) = time_windows(readings['time'], np.append(starts, len(person)))
+    reopened = []
+    reopentimes = []
+    for (s, e) in zip(starts.tolist(), ends.tolist()):
+        p = int(person[s])
+        if(store['count'][p] > 0):
+            entry[s] = readings['time'][s]
+            reopened.append(store['last'][p])
+            reopentimes.append(readings['time'][s])
+        store['count'][p] += e - s
+        store['last'][p] = n + e - 1
+
+    newcols = dict(readings, entry=entry, exit=exit)
+    for c in store['cols']:
+        store['cols'][c] = append_buffer(store['cols'][c], n, newcols[c])
+    store['n'] = n + len(person)
+    trace_store_views(store)
+    reopened = np.array(reopened, dtype=np.int64)
+    store['exit'][reopened] = reopentimes
+    newidx = np.arange(n, store['n'], dtype=np.int64)
+    add_sorted_run(store['later'], person * (2 ** 32) + readings['node'], newidx)
+
+    #a batch further from the equator needs a wider grid
+    maxlat = float(np.max(np.abs(readings['lat'])))
+    if('grid' not in state):
+        state['maxlat'] = max(state['maxlat'], maxlat)
+    elif(maxlat > state['maxlat']):
+        state['maxlat'] = maxlat
+        index_trace_state(state)
+    else:
+        grow_trace_grid(state, newidx)
+    return newidx, reopened
+
+#makes a change to the graph of a trace state and records it in the state's delta, so saving
+#the state only writes what changed (see save_trace_state). change is one of ('node', label,
+#lat, lon, HHMM time), ('edge', u, v, attribute, value), ('set', label, attribute, value) and ('unset',
+#label, attribute). Setting a node attribute to the value it has already changes nothing.
+def change_trace_graph(state, change, record=True):
+    g = state['graph']
+    kind = change[0]
+    if(kind == 'node'):
+        g.add_node(change[1], latlon=LatLon(Latitude(change[2]),Longitude(change[3])), time=change[4])
+    elif(kind == 'edge'):
+        g.add_edge(change[1], change[2], **{change[3]: change[4]})
+    elif(kind == 'set'):
+        if(g.nodes[change[1]].get(change[2]) == change[3]):
+            return
+        g.nodes[change[1]][change[2]] = change[3]
+    else:
+        if(change[2] not in g.nodes[change[1]]):
+            return
+        del g.nodes[change[1]][change[2]]
+    if(record):
+        state['delta']['graph'].append(change)
+
+#adds a batch of new readings (rows of the raw data form) to a trace state and traces only
+#them. A person's new readings must come after the ones already in the state, the whole
+#batch is checked before the state is changed. New readings are compared with the readings
+#around them, and a person's previous last reading, whose exit time is now known, is
+#checked again for time overlaps. Breach edges, 'breached' and 'infec_start_loc' are
+#updated in place on the state's graph, the same way a full run would mark them. Conditions
+#of people already in the state are kept (see set_condition). The state's louvain
+#communities are dropped as the graph changed (see trace_state_communities). Only the
+#batch, the people it has and the readings around it are looked at.
+#Returns the travel history of the compared pairs and the names of new sick people.
+@timed
+def trace_new_readings(state, df):
+    store = state['store']
+    newnames = []
+    newcons = []
+    newsick = []
+    parts = []
+
+    #work out the person and node of every new reading
+    for currname, rows in df.groupby('name', sort=False):
+        rows = rows.sort_values(by=['time'])
+        times = hhmm_to_minutes(rows['time'].values)
+        if(currname in state['people']):
+            p = state['people'][currname]
+            n0 = store['count'][p]
+            if(n0 > 0 and times[0] < store['time'][store['last'][p]]):
+                raise ValueError("New readings of " + str(currname) + " are older than the ones already traced.")
+        else:
+            p = len(store['names']) + len(newnames)
+            n0 = 0
+            newnames.append(currname)
+            newcons.append(rows['condition'].values[0])
+            if(newcons[-1] == 'sick'):
+                newsick.append(currname)
+        parts.append((np.full(len(rows), p), n0 + np.arange(len(rows)), rows['lat'].values,
+            rows['lon'].values, times))
+
+    if(len(parts) == 0):
+        return new_travel_hist(store['names'], store['cons']), newsick
+
+    #the whole batch is fine, only now the state is changed
+    readings = dict((c, np.concatenate([part[k] for part in parts]).astype(t))
+        for (k, (c, t)) in enumerate(col_trace_readings))
+    state.pop('communities', None)
+    state.pop('community_index', None)
+    (newidx, reopenidx) = add_trace_readings(state, newnames, newcons, readings)
+    state['delta']['batches'].append((newnames, newcons, readings))
+    names = store['names']
+    cons = store['cons']
+
+    #add them to the graph like build_bigdaddy does
+    times = minutes_to_hhmm(readings['time'])
+    for k in range(0, len(newidx)):
+        label = str(names[readings['person'][k]]) + str(readings['node'][k])
+        change_trace_graph(state, ('node', label, float(readings['lat'][k]), float(readings['lon'][k]),
+            int(times[k])))
+        if(readings['node'][k] > 0):
+            change_trace_graph(state, ('edge', str(names[readings['person'][k]]) + str(readings['node'][k] - 1),
+                label, 'time', int(times[k])))
+
+    #pairs to check. New readings against everything around them, each pair of new readings
+    #once. Reopened readings against the old readings around them, their breaches are
+    #already marked but their time window just grew.
+    query = np.concatenate((newidx, reopenidx))
+    (which, ib) = trace_state_neighbours(state, store['lat'][query], store['lon'][query])
+    ia = query[which]
+    isnew = which < len(newidx)
+    pa = store['person'][ia]
+    pb = store['person'][ib]
+    keep = (pb != pa) & ~((ib >= newidx[0]) & (~isnew | (ib < ia)))
+    (ia, ib, isnew, pa, pb) = (ia[keep], ib[keep], isnew[keep], pa[keep], pb[keep])
+    na = store['node'][ia]
+    nb = store['node'][ib]
+    entry = store['entry']
+    exit = store['exit']
+
+    dists = find_distances(store['lat'][ia], store['lon'][ia], store['lat'][ib], store['lon'][ib])
+    sick = sick_people(cons, np.concatenate((pa, pb)))
+    breach = dists <= microcell_radius
+    overlap = np.maximum(entry[ia], entry[ib]) <= np.minimum(exit[ia], exit[ib])
+    high = breach & overlap & (sick[:len(pa)] | sick[len(pa):])
+    add_count('candidate_pairs', len(dists))
+    add_count('breaches', np.count_nonzero(breach))
+    add_count('high_risk', np.count_nonzero(high))
+    for k in np.flatnonzero(breach):
+        lbl1 = str(names[pa[k]]) + str(na[k])
+        lbl2 = str(names[pb[k]]) + str(nb[k])
+        if(isnew[k]):
+            change_trace_graph(state, ('edge', lbl1, lbl2, 'breachnodes', lbl1 + ':' + lbl2))
+            if(symmetric_pairs == 0):
+                change_trace_graph(state, ('edge', lbl2, lbl1, 'breachnodes', lbl2 + ':' + lbl1))
+            change_trace_graph(state, ('set', lbl1, 'breached', 'yes'))
+            change_trace_graph(state, ('set', lbl2, 'breached', 'yes'))
+        if(high[k]):
+            if(cons[pa[k]] == 'healthy'):
+                change_trace_graph(state, ('set', lbl1, 'infec_start_loc', 'yes'))
+            if(cons[pb[k]] == 'healthy'):
+                change_trace_graph(state, ('set', lbl2, 'infec_start_loc', 'yes'))
+
+    hist = new_travel_hist(names, cons, max(1, len(dists)))
+    append_travel_hist(hist, {'person1': pa, 'node1': na, 'lat1': store['lat'][ia], 'lon1': store['lon'][ia],
+        'entry1': entry[ia], 'exit1': exit[ia],
+        'person2': pb, 'node2': nb, 'lat2': store['lat'][ib], 'lon2': store['lon'][ib],
+        'entry2': entry[ib], 'exit2': exit[ib],
+        'dist': dists, 'breach': breach, 'high': high})
+    printcov("Traced " + str(len(newidx)) + " new readings, " + str(len(dists)) + " loc pairs compared, " +
+        str(int(breach[isnew].sum())) + " new breaches.")
+    return hist, newsick
+
+#returns the (person, node) of a graph node label of a trace state. Labels are the name
+#of the person followed by the node number.
+def reading_of_label(state, label):
+    name = label_name(label)
+    return state['people'][name], int(label[len(name):])
+
+#returns the nodes that share a breach edge with the given node of g
+def breach_neighbours(g, label):
+    return [nb for nb in g[label] if any('breachnodes' in d for d in g[label][nb].values())]
+
+#sets or clears 'infec_start_loc' of a node of a trace state's graph from its breach edges.
+#It is set when the node's person is healthy and a breach neighbour overlapping in time
+#belongs to a sick person, the same rule find_overlap marks it by.
+def update_infec_start_loc(state, label):
+    store = state['store']
+    (p, n) = reading_of_label(state, label)
+    infec = False
+    if(store['cons'][p] == 'healthy'):
+        sicknbs = [pn for pn in [reading_of_label(state, nb) for nb in breach_neighbours(state['graph'], label)]
+            if store['cons'][pn[0]] == 'sick']
+        if(len(sicknbs) > 0):
+            i = reading_index(store, [p], [n])
+            j = reading_index(store, [pn[0] for pn in sicknbs], [pn[1] for pn in sicknbs])
+            infec = bool(np.any(np.maximum(store['entry'][i], store['entry'][j]) <=
+                np.minimum(store['exit'][i], store['exit'][j])))
+    if(infec):
+        change_trace_graph(state, ('set', label, 'infec_start_loc', 'yes'))
+    else:
+        change_trace_graph(state, ('unset', label, 'infec_start_loc'))
+
+#returns the louvain communities of a trace state's graph and their index (see
+#index_communities). They do not depend on anyone's condition so they are found once and
+#kept in the state, and saved with it, until new readings change the graph.
+def trace_state_communities(state):
+    if('communities' not in state):
+        state['communities'] = find_communities_based_on_loc(state['graph'])
+        state['community_index'] = index_communities(state['communities'])
+        state['communities_saved'] = False
+    return state['communities'], state['community_index']
+
+#changes the condition of a person of a trace state (see new_trace_state) to 'sick' or back
+#to 'healthy' once recovered, without a full recompute. Only the 'infec_start_loc' of the
+#person's locs and of the locs they breached are worked out again, from the breach edges
+#already in the graph. If hist is given, its risk of the person's loc pairs is updated too.
+#Returns the vulnerable communities and people of the person if they are now sick (see
+#find_vuln_loc_and_ppl), empty lists otherwise.
+@timed
+def set_condition(state, name, condition, hist=None):
+    if(condition not in ('sick', 'healthy')):
+        raise ValueError("Condition must be 'sick' or 'healthy', got: " + str(condition))
+    if(name not in state['people']):
+        raise ValueError("Unknown person: " + str(name))
+    store = state['store']
+    p = state['people'][name]
+    if(store['cons'][p] == condition):
+        return [], []
+    printcov("Condition of " + str(name) + " changed to: " + condition)
+    store['cons'][p] = condition
+    state['delta']['cons'][p] = condition
+
+    labels = [str(name) + str(n) for n in range(0, store['count'][p])]
+    affected = set(labels)
+    for label in labels:
+        affected.update(breach_neighbours(state['graph'], label))
+    for label in affected:
+        update_infec_start_loc(state, label)
+
+    if(hist is not None):
+        hist['cons'][p] = condition
+        cols = hist['cols']
+        n = hist['n']
+        rows = np.flatnonzero((cols['person1'][:n] == p) | (cols['person2'][:n] == p))
+        sick = sick_people(store['cons'], np.concatenate((cols['person1'][rows], cols['person2'][rows])))
+        overlap = (np.maximum(cols['entry1'][rows], cols['entry2'][rows]) <=
+            np.minimum(cols['exit1'][rows], cols['exit2'][rows]))
+        cols['high'][rows] = cols['breach'][rows] & overlap & (sick[:len(rows)] | sick[len(rows):])
+
+    if(condition == 'sick'):
+        (comm_list, commidx) = trace_state_communities(state)
+        return find_vuln_loc_and_ppl(comm_list, str(name), commidx)
+    return [], []
+
+#saves a trace state to a folder, see trace_new_readings. The first save to a folder writes
+#the whole state, its store, graph and spatial grid, so loading it does not rebuild them.
+#Later saves of the state loaded from it only write the changes made since as the next
+#delta-<k>.gz: the new people and readings, condition changes and changes to the graph. The
+#grid is written again only if it was rebuilt. Louvain communities found so far are saved
+#with it too.
+def save_trace_state(state, folder):
+    if(state.get('folder') != folder or not os.path.exists(os.path.join(folder, 'store.npz'))):
+        write_trace_state(state, folder)
+    else:
+        write_trace_delta(state, folder)
+    state['folder'] = folder
+    state['delta'] = new_trace_delta()
+    if(not state['grid_saved']):
+        (keys, readings) = merged_sorted_runs(state['grid'])
+        np.savez(os.path.join(folder, 'grid.npz'), cell_km=state['cell_km'], maxlat=state['maxlat'],
+            keys=keys, reading=readings)
+        state['grid_saved'] = True
+
+    commpath = os.path.join(folder, 'communities.json')
+    if('communities' in state):
+        if(not state.get('communities_saved', False)):
+            with open(commpath, 'w') as f:
+                json.dump(state['communities'], f)
+            state['communities_saved'] = True
+    elif(os.path.exists(commpath)):
+        os.remove(commpath)
+
+#returns the entries of sorted runs (see add_sorted_run) as one run
+def merged_sorted_runs(runs):
+    keys = np.concatenate([np.zeros(0, dtype=np.int64)] + [r[0] for r in runs])
+    values = np.concatenate([np.zeros(0, dtype=np.int64)] + [r[1] for r in runs])
+    order = np.argsort(keys, kind='mergesort')
+    return keys[order], values[order]
+
+#writes the whole of a trace state to a folder, see save_trace_state. The store is written
+#as a trajectory store, so the state's readings are renumbered to its order, grid included.
+def write_trace_state(state, folder):
+    if(not os.path.isdir(folder)):
+        os.makedirs(folder)
+    for f in os.listdir(folder):
+        if(f.startswith('delta-')):
+            os.remove(os.path.join(folder, f))
+    store = state['store']
+    order = np.lexsort((store['node'], store['person']))
+    plain = dict((c, store[c][order]) for (c, t) in col_trace_store)
+    plain.update({'names': store['names'], 'cons': store['cons'],
+        'offsets': np.append(0, np.cumsum(store['count'])).astype(np.int64)})
+    save_store(plain, folder)
+    save_graph_to_pickle(state['graph'], os.path.join(folder, 'graph.gz'))
+
+    renumbered = np.empty(len(order), dtype=np.int64)
+    renumbered[order] = np.arange(len(order))
+    state['store'] = trace_store(plain)
+    state['grid'] = [(keys, renumbered[readings]) for (keys, readings) in state['grid']]
+    state['grid_saved'] = False
+    state['deltas'] = 0
+    state['communities_saved'] = False
+
+#writes the changes of a trace state since it was last saved or loaded as the next delta of
+#its folder, see save_trace_state. The delta is written to a temp file first and moved in
+#place once complete, so an interrupted save never leaves half a delta behind.
+def write_trace_delta(state, folder):
+    delta = state['delta']
+    if(len(delta['batches']) == 0 and len(delta['cons']) == 0 and len(delta['graph']) == 0):
+        return
+    path = os.path.join(folder, 'delta-%06d.gz' % state['deltas'])
+    with gzip.open(path + '.tmp', 'wb') as f:
+        pickle.dump(delta, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(path + '.tmp', path)
+    state['deltas'] += 1
+    printcov("Saved the changes to the trace state to: " + path)
+
+#loads a trace state saved by save_trace_state, the whole state and then its deltas in order
+def load_trace_state(folder):
+    state = trace_state_of_store(load_store(folder), read_graph_from_pickle(os.path.join(folder, 'graph.gz')))
+    deltas = sorted(f for f in os.listdir(folder) if f.startswith('delta-') and f.endswith('.gz'))
+    for f in deltas:
+        with gzip.open(os.path.join(folder, f), 'rb') as fd:
+            delta = pickle.load(fd)
+        for (names, cons, readings) in delta['batches']:
+            add_trace_readings(state, names, cons, readings)
+        for p in delta['cons']:
+            state['store']['cons'][p] = delta['cons'][p]
+        for change in delta['graph']:
+            change_trace_graph(state, change, record=False)
+    state['folder'] = folder
+    state['deltas'] = len(deltas)
+
+    grid = None
+    if(os.path.exists(os.path.join(folder, 'grid.npz'))):
+        grid = dict(np.load(os.path.join(folder, 'grid.npz')))
+    attach_trace_grid(state, grid)
+    if(os.path.exists(os.path.join(folder, 'communities.json'))):
+        with open(os.path.join(folder, 'communities.json')) as f:
+            state['communities'] = [[str(x) for x in comm] for comm in json.load(f)]
+        state['community_index'] = index_communities(state['communities'])
+        state['communities_saved'] = True
+    return state
 
 #finds the exit time for the given graph's node. exit time = time when the person exited a recorded loc
 def find_endtime_gx(nodelabelsuffix, gx, nodelabelprefix):
@@ -325,8 +1857,19 @@ def find_startime_gx(nodelabelsuffix, gx, nodelabelprefix):
     return entm1
 
 #allows to validate all graphs. For each graph, walks it, explodes nodes and edges.
+#g is a list of per person graphs or a trajectory store.
+@timed
 def test_all_graphs(g):
     printcov("=========> Testing all graphs: ")
+    if(isinstance(g, dict)):
+        test_trajectory_store(g)
+        printcov("=========> Testing complete.")
+        return
+
+    #graphs are only walked to print them
+    if(log_level < log_debug):
+        printcov("=========> Testing complete.")
+        return
     for i in range(0, len(g)):
         print(nx.info(g[i]))
 
@@ -345,19 +1888,570 @@ def test_all_graphs(g):
     printcov("=========> Testing complete.")
     return
 
+#walks the trajectory store the same way test_all_graphs walks graphs and checks that
+#its arrays are consistent with each other
+def test_trajectory_store(store):
+    offsets = store['offsets']
+    total = len(store['lat'])
+    if(offsets[0] != 0 or offsets[-1] != total or np.any(np.diff(offsets) < 0)):
+        raise ValueError("Trajectory store offsets do not match its readings.")
+    for col in ('lon', 'time', 'entry', 'exit'):
+        if(len(store[col]) != total):
+            raise ValueError("Trajectory store column " + col + " does not match its readings.")
+
+    if(log_level < log_debug):
+        return
+    for p in range(0, store_size(store)):
+        traj = person_trajectory(store, p)
+        name = str(traj['name'])
+        print("Name: " + name + " | " + str(traj['con']))
+        print("Number of nodes: " + str(len(traj['lat'])))
+        print(" - Nodes:")
+        latlons = latlon_strings(traj)
+        for x1 in range(0, len(latlons)):
+            print("Node id: " + name + str(x1) + " " + latlons[x1] +
+                " entry: " + str(minutes_to_hhmm(traj['entry'][x1])) +
+                " exit: " + str(minutes_to_hhmm(traj['exit'][x1])))
+        print('------------------------------------------')
+    return
+
+#checks the predicted infection locs (see predict_next_infec_locations) against the
+#exposure ranking of the same run (see save_exposures). A prediction needs a sick person
+#at a breached loc at the same time as someone else, which is an exposure of a sick pair,
+#so there can be no prediction without one.
+def test_predictions(predicted, exposures):
+    sickpairs = np.count_nonzero((exposures['con1'].values == 'sick') | (exposures['con2'].values == 'sick'))
+    if(sickpairs == 0 and len(predicted) > 0):
+        raise ValueError("Predicted " + str(len(predicted)) + " infection locations but no sick " +
+            "person was with anyone.")
+
 #builds a graph for all of the population. Is an undirected
 #graph and is used for running analysis algorithms.
+#gxarray is a list of per person graphs or a trajectory store.
+@timed
 def build_bigdaddy(gxarray):
+    if(isinstance(gxarray, dict)):
+        return build_bigdaddy_from_store(gxarray)
 
+    #graphs are added in place, composing would copy the graph built so far every time
     gxdaddytemp = nx.MultiGraph()
     for i in range(0,len(gxarray)):
-        gxdaddytemp = nx.compose(gxdaddytemp,gxarray[i].to_undirected())
+        undgx = gxarray[i].to_undirected()
+        gxdaddytemp.graph.update(undgx.graph)
+        gxdaddytemp.add_nodes_from(undgx.nodes(data=True))
+        gxdaddytemp.add_edges_from(undgx.edges(keys=True, data=True))
 
     return gxdaddytemp
 
+#builds the same graph as build_bigdaddy does from per person graphs, straight from
+#the trajectory store in one pass. Each reading is a node with its 'latlon' and HHMM
+#'time' and consecutive readings of a person are joined by an edge with the HHMM 'time' of the
+#later one.
+def build_bigdaddy_from_store(store):
+    gxdaddytemp = nx.MultiGraph()
+    offsets = store['offsets']
+    times = minutes_to_hhmm(store['time'])
+    for p in range(0, store_size(store)):
+        name = str(store['names'][p])
+        traj = person_trajectory(store, p)
+        for n in range(0, len(traj['lat'])):
+            gxdaddytemp.add_node(name + str(n),
+                latlon=LatLon(Latitude(float(traj['lat'][n])),Longitude(float(traj['lon'][n]))),
+                time=times[offsets[p] + n])
+        for n in range(1, len(traj['lat'])):
+            gxdaddytemp.add_edge(name + str(n - 1), name + str(n), time=times[offsets[p] + n])
+
+    #composing graphs leaves the name and con of the last person on the graph
+    if(store_size(store) > 0):
+        gxdaddytemp.graph['name'] = store['names'][-1]
+        gxdaddytemp.graph['con'] = store['cons'][-1]
+    return gxdaddytemp
+
+#builds the contact graph, an integer indexed replacement of biggx held as CSR adjacency
+#arrays. Node i is reading i of the trajectory store, so person p's locs are the nodes
+#offsets[p] to offsets[p+1]. Edges are the ones build_bigdaddy and find_overlap add to
+#biggx: consecutive readings of a person, plus one per breach row of the travel history.
+#Built in one pass with numpy, the contact graph is a copy of the store with:
+# - indptr, indices: the neighbours of node i are indices[indptr[i]:indptr[i+1]], in the
+#   order biggx has them. Parallel edges show up once per edge, like in the multigraph.
+# - breach1, breach2: the two nodes of each breach edge, in travel history order
+# - breached, infec: bool per node, the 'breached' and 'infec_start_loc' node attributes
+@timed
+def build_contact_graph(store, hist):
+    offsets = store['offsets']
+    nnodes = len(store['lat'])
+    cols = hist['cols']
+    n = hist['n']
+
+    rows = cols['breach'][:n].copy()
+    if(symmetric_pairs == 1):
+        #mirrored rows were never compared, their edge is there as (B, A) already
+        rows &= cols['person1'][:n] < cols['person2'][:n]
+    rows = np.flatnonzero(rows)
+    b1 = offsets[cols['person1'][rows]] + cols['node1'][rows]
+    b2 = offsets[cols['person2'][rows]] + cols['node2'][rows]
+
+    #trajectory edges join a reading with the next one of the same person
+    isstart = np.zeros(nnodes + 1, dtype=bool)
+    isstart[offsets] = True
+    t1 = np.flatnonzero(~isstart[1:nnodes])
+    t2 = t1 + 1
+
+    #previous loc, next loc, then breaches in row order. A stable sort keeps that order.
+    src = np.concatenate((t2, t1, np.column_stack((b1, b2)).ravel()))
+    dst = np.concatenate((t1, t2, np.column_stack((b2, b1)).ravel()))
+    order = np.argsort(src, kind='mergesort')
+    indptr = np.zeros(nnodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=nnodes))
+
+    breached = np.zeros(nnodes, dtype=bool)
+    breached[b1] = True
+    breached[b2] = True
+    infec = np.zeros(nnodes, dtype=bool)
+    high = np.flatnonzero(cols['high'][:n])
+    healthy = np.array(store['cons']) == 'healthy'
+    for c in ('1', '2'):
+        people = cols['person' + c][high]
+        nodes = offsets[people] + cols['node' + c][high]
+        infec[nodes[healthy[people]]] = True
+
+    cg = dict(store)
+    cg.update({'indptr': indptr, 'indices': dst[order], 'breach1': b1, 'breach2': b2,
+        'breached': breached, 'infec': infec})
+    printcov("Contact graph built with " + str(nnodes) + " locs and " + str(len(b1)) + " breach edges.")
+    return cg
+
+#returns the node labels (as in biggx) of the given nodes of a contact graph, all by default
+def contact_labels(cg, ids=None):
+    if(ids is None):
+        ids = np.arange(len(cg['lat']))
+    ids = np.asarray(ids, dtype=np.int64)
+    people = np.searchsorted(cg['offsets'], ids, side='right') - 1
+    names = cg['names']
+    return [str(names[p]) + str(n) for (p, n) in zip(people.tolist(), (ids - cg['offsets'][people]).tolist())]
+
+#returns the degree of every node of a contact graph
+def contact_degree(cg):
+    return np.diff(cg['indptr'])
+
+#builds the networkx graph of a contact graph, the same as biggx would have been. Only
+#done on demand, e.g. to display it.
+def contact_to_networkx(cg):
+    g = build_bigdaddy_from_store(cg)
+    labels = contact_labels(cg)
+    for (a, b) in zip(cg['breach1'].tolist(), cg['breach2'].tolist()):
+        g.add_edge(labels[a], labels[b], breachnodes=(labels[a] + ':' + labels[b]))
+    for i in np.flatnonzero(cg['breached']).tolist():
+        g.nodes[labels[i]]['breached'] = 'yes'
+    for i in np.flatnonzero(cg['infec']).tolist():
+        g.nodes[labels[i]]['infec_start_loc'] = 'yes'
+    return g
+
+#returns the networkx graph of either a networkx graph or a contact graph
+def as_graph(g):
+    if(isinstance(g, dict)):
+        return contact_to_networkx(g)
+    return g
+
+#saves / loads a contact graph as compressed numpy arrays
+def save_contact_graph(cg, path):
+    arrays = dict((c, cg[c]) for c in col_contact_graph)
+    np.savez_compressed(path, names=np.array(cg['names']), cons=np.array(cg['cons']), **arrays)
+
+def read_contact_graph(path):
+    data = np.load(path)
+    cg = dict((c, data[c]) for c in col_contact_graph)
+    cg['names'] = data['names'].tolist()
+    cg['cons'] = data['cons'].tolist()
+    return cg
+
+#louvain communities of a contact graph, found on its CSR arrays. Returns the community
+#number of every node. Each level moves nodes to the neighbouring community with the best
+#modularity gain (see louvain_level), then merges every community into one node of the
+#next level (see merge_communities), until no node moves.
+def contact_louvain(cg):
+    indptr = cg['indptr']
+    indices = cg['indices']
+    weights = np.ones(len(indices))
+    nodecomm = np.arange(len(indptr) - 1)
+    while(True):
+        (comm, moved) = louvain_level(indptr, indices, weights)
+        if(not moved):
+            break
+        (comm, indptr, indices, weights) = merge_communities(indptr, indices, weights, comm)
+        nodecomm = comm[nodecomm]
+    return nodecomm
+
+#returns the modularity of a partition of a weighted CSR graph
+def csr_modularity(indptr, indices, weights, comm):
+    m2 = weights.sum()
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    inside = comm[rows] == comm[indices]
+    inw = np.bincount(comm[rows][inside], weights[inside], minlength=len(comm))
+    tot = np.bincount(comm[rows], weights, minlength=len(comm))
+    return float((inw / m2 - (tot / m2) ** 2).sum())
+
+#one level of louvain on a weighted CSR graph. Nodes start in a community of their own and
+#are moved, one at a time, to the neighbouring community that gains the most modularity.
+#Passes over all nodes repeat until modularity gains less than louvain_min_gain. Returns
+#the community of every node and whether any node moved.
+def louvain_level(indptr, indices, weights):
+    n = len(indptr) - 1
+    m2 = float(weights.sum())
+    comm = list(range(0, n))
+    if(m2 == 0):
+        return np.array(comm), False
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    k = np.bincount(rows, weights, minlength=n).tolist()
+    tot = list(k)
+    ptr = indptr.tolist()
+    nbs = indices.tolist()
+    ws = weights.tolist()
+
+    moved = False
+    mod = csr_modularity(indptr, indices, weights, np.array(comm))
+    while(True):
+        moves = 0
+        for i in range(0, n):
+            ci = comm[i]
+            links = {}
+            for e in range(ptr[i], ptr[i + 1]):
+                j = nbs[e]
+                if(j != i):
+                    links[comm[j]] = links.get(comm[j], 0.0) + ws[e]
+            tot[ci] -= k[i]
+            best = ci
+            bestgain = links.get(ci, 0.0) - tot[ci] * k[i] / m2
+            for (c, w) in links.items():
+                gain = w - tot[c] * k[i] / m2
+                if(gain > bestgain):
+                    best = c
+                    bestgain = gain
+            tot[best] += k[i]
+            if(best != ci):
+                comm[i] = best
+                moves = moves + 1
+        if(moves == 0):
+            break
+        moved = True
+        newmod = csr_modularity(indptr, indices, weights, np.array(comm))
+        if(newmod - mod < louvain_min_gain):
+            break
+        mod = newmod
+    return np.array(comm), moved
+
+#merges the communities of a weighted CSR graph into single nodes. Weights of the edges
+#between two communities are summed, edges inside one become a self loop. Returns the
+#communities renumbered from 0 and the CSR arrays of the merged graph.
+def merge_communities(indptr, indices, weights, comm):
+    (ids, comm) = np.unique(comm, return_inverse=True)
+    nc = len(ids)
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    keys = comm[rows].astype(np.int64) * nc + comm[indices]
+    (ukeys, inv) = np.unique(keys, return_inverse=True)
+    mindptr = np.zeros(nc + 1, dtype=np.int64)
+    mindptr[1:] = np.cumsum(np.bincount(ukeys // nc, minlength=nc))
+    return comm, mindptr, ukeys % nc, np.bincount(inv, weights)
+
+#number of csv rows read at a time by the streaming ingest. A quarter of stream_memory_mb
+#goes to the chunk being read, the rest to spill buffers and the partition being joined.
+def stream_chunk_rows():
+    return max(1000, int(stream_memory_mb * 1024 * 1024 / 4 / stream_row_bytes))
+
+#reads only the latitudes of the csv, chunk by chunk, and returns the highest absolute
+#one. Needed up front so that every partition uses the same grid.
+def stream_max_lat(path):
+    maxlat = 0.0
+    for chunk in pd.read_csv(path, sep=',', header=0, usecols=['lat'], chunksize=stream_chunk_rows()):
+        if(len(chunk) > 0):
+            maxlat = max(maxlat, float(np.max(np.abs(chunk['lat'].values))))
+    return maxlat
+
+#reads the csv chunk by chunk and yields the complete people of each chunk as a trajectory
+#store, prepp'd the same way as dataprep does. people holds 'names' and 'cons' of every
+#person seen so far and gets the new ones appended, so the store's person p is person
+#first + p of the population. Each person's readings must be together in the csv (as
+#generator.py writes them), the last person of a chunk is carried over to the next one.
+def stream_people(path, people):
+    seen = set(people['names'])
+    pending = None
+    for chunk in pd.read_csv(path, sep=',', header=0, chunksize=stream_chunk_rows()):
+        if(pending is not None):
+            chunk = pd.concat([pending, chunk])
+        lastname = chunk['name'].values[-1]
+        pending = chunk[chunk['name'] == lastname]
+        chunk = chunk[chunk['name'] != lastname]
+        store = stream_prep_chunk(chunk, people, seen)
+        if(store is not None):
+            yield store
+    if(pending is not None):
+        store = stream_prep_chunk(pending, people, seen)
+        if(store is not None):
+            yield store
+
+#prepares the rows of complete people read by stream_people. Returns a trajectory store
+#with the index of its first person in the population as 'first', None if empty.
+def stream_prep_chunk(chunk, people, seen):
+    if(len(chunk) == 0):
+        return None
+    first = len(people['names'])
+    sortedgroups = []
+    for currname, df in chunk.groupby('name', sort=False):
+        if(currname in seen):
+            raise ValueError("Streaming ingest needs each person's readings together in the csv. " +
+                str(currname) + " shows up again.")
+        seen.add(currname)
+        sortedgroups.append(df.sort_values(by=['time']))
+    store = build_trajectory_store(pd.concat(sortedgroups))
+    people['names'].extend(store['names'])
+    people['cons'].extend(store['cons'])
+    store['first'] = first
+    return store
+
+#writes the readings of a trajectory store to the spill files of their partition. A
+#partition is a spatial cell of stream_partition_km and a time bucket of stream_time_bucket
+#minutes. A reading goes to the cell it is in and to every time bucket its [entry, exit]
+#window covers. Readings whose window is empty can never overlap in time and are dropped.
+#partitions (key -> readings written) is updated.
+def spill_readings(store, cell_km, lon_scale, spilldir, partitions):
+    counts = np.diff(store['offsets'])
+    recs = np.empty(len(store['lat']), dtype=spill_dtype)
+    recs['person'] = store['first'] + np.repeat(np.arange(store_size(store)), counts)
+    recs['node'] = np.arange(len(recs)) - np.repeat(store['offsets'][:-1], counts)
+    recs['lat'] = store['lat']
+    recs['lon'] = store['lon']
+    recs['time'] = store['time']
+    recs['entry'] = store['entry']
+    recs['exit'] = store['exit']
+    recs = recs[recs['entry'] <= recs['exit']]
+
+    (cy, cx) = grid_cells(recs['lat'], recs['lon'], cell_km, lon_scale)
+    b0 = recs['entry'] // stream_time_bucket
+    reps = recs['exit'] // stream_time_bucket - b0 + 1
+    idx = np.repeat(np.arange(len(recs)), reps)
+    bucket = b0[idx] + np.arange(len(idx)) - np.repeat(np.cumsum(reps) - reps, reps)
+    cy = cy[idx]
+    cx = cx[idx]
+
+    #group the copies by partition and append each group to its file
+    order = np.lexsort((bucket, cx, cy))
+    keys = np.column_stack((cy[order], cx[order], bucket[order]))
+    bounds = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+    for (s, e) in zip(np.append(0, bounds), np.append(bounds, len(order))):
+        if(e <= s):
+            continue
+        key = tuple(int(k) for k in keys[s])
+        with open(spill_path(spilldir, key), 'ab') as f:
+            recs[idx[order[s:e]]].tofile(f)
+        partitions[key] = partitions.get(key, 0) + (e - s)
+
+#returns the spill file of a partition
+def spill_path(spilldir, key):
+    return os.path.join(spilldir, "%d_%d_%d.bin" % key)
+
+#loads the readings spilled to a partition, empty if it has none
+def load_partition(spilldir, key, partitions):
+    if(key not in partitions):
+        return np.zeros(0, dtype=spill_dtype)
+    return np.fromfile(spill_path(spilldir, key), dtype=spill_dtype)
+
+#loads the readings spilled to a partition for which keep(readings) is True, reading the
+#file stream_chunk_rows() readings at a time. Empty if the partition has none.
+def load_partition_where(spilldir, key, partitions, keep):
+    if(key not in partitions):
+        return np.zeros(0, dtype=spill_dtype)
+    parts = []
+    with open(spill_path(spilldir, key), 'rb') as f:
+        while(True):
+            recs = np.fromfile(f, dtype=spill_dtype, count=stream_chunk_rows())
+            if(len(recs) == 0):
+                break
+            parts.append(recs[keep(recs)])
+    return np.concatenate(parts)
+
+#returns the memory a join of the given number of readings takes, roughly
+def partition_bytes(readings):
+    return readings * spill_dtype.itemsize * 4
+
+#joins a partition too big for the memory budget (see join_partition) in rows of sub-cells.
+#The partition's cell is cut into nrows rows, each at least microcell_radius high, and the
+#readings of a row are joined with the readings of the row above, itself and the row below
+#in the partition and its 8 neighbours. Two locs within the microcell are never more than
+#a row apart so every pair is found once, in the row of its anchor. Only one row's readings
+#are loaded at a time, the spill files are scanned for each. Yields what join_partition
+#returns, row by row.
+def join_partition_rows(spilldir, key, partitions, cell_km, lon_scale, nrows):
+    (cy, cx, bucket) = key
+    rowkm = cell_km / nrows
+    def row_of(recs):
+        return np.floor(recs['lat'] * km_per_deg_lat / rowkm).astype(np.int64)
+    for r in range(cy * nrows, (cy + 1) * nrows):
+        #rounding may put a reading of the partition just outside its rows
+        if(r == cy * nrows):
+            inrow = lambda recs: row_of(recs) <= r
+        elif(r == (cy + 1) * nrows - 1):
+            inrow = lambda recs: row_of(recs) >= r
+        else:
+            inrow = lambda recs: row_of(recs) == r
+        anchors = load_partition_where(spilldir, key, partitions, inrow)
+        if(len(anchors) == 0):
+            continue
+        near = lambda recs: np.abs(row_of(recs) - r) <= 1
+        others = np.concatenate([load_partition_where(spilldir, (cy + dy, cx + dx, bucket), partitions, near)
+            for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+        yield join_partition(anchors, others, bucket, lon_scale)
+
+#finds the overlaps of the readings of one partition (anchors) with the readings of the
+#same time bucket in the partition and its 8 neighbours (others). A pair is only kept in
+#the time bucket where it starts to overlap, so it is found exactly once over all the
+#partitions. Returns the anchor readings, the other readings and their distances, sorted
+#by anchor person and loc.
+def join_partition(anchors, others, bucket, lon_scale):
+    cell_km = max(microcell_radius, 1e-9) * 1.01
+    (oy, ox) = grid_cells(others['lat'], others['lon'], cell_km, lon_scale)
+    grid = {}
+    for (j, cell) in enumerate(zip(oy.tolist(), ox.tolist())):
+        grid.setdefault(cell, []).append(j)
+
+    (ay, ax) = grid_cells(anchors['lat'], anchors['lon'], cell_km, lon_scale)
+    ia = []
+    ib = []
+    for (i, (cy, cx)) in enumerate(zip(ay.tolist(), ax.tolist())):
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                near = grid.get((cy + dy, cx + dx), [])
+                ia.extend([i] * len(near))
+                ib.extend(near)
+    a = anchors[np.array(ia, dtype=np.intp)]
+    o = others[np.array(ib, dtype=np.intp)]
+
+    start = np.maximum(a['entry'], o['entry'])
+    keep = ((a['person'] != o['person']) & (start <= np.minimum(a['exit'], o['exit'])) &
+        (start // stream_time_bucket == bucket))
+    if(symmetric_pairs == 1):
+        keep &= a['person'] < o['person']
+    a = a[keep]
+    o = o[keep]
+    order = np.lexsort((o['node'], o['person'], a['node'], a['person']))
+    a = a[order]
+    o = o[order]
+    return a, o, find_distances(a['lat'], a['lon'], o['lat'], o['lon'])
+
+#marks the breaches of a joined partition on biggx and returns its travel history rows
+#as a dict of column arrays (see col_travel_hist). All pairs of a joined partition overlap
+#in time, so a breach is high risk if one of the two people is sick.
+def record_partition(a, o, dists, people):
+    names = people['names']
+    cons = people['cons']
+    breach = dists <= microcell_radius
+    high = np.zeros(len(dists), dtype=np.bool_)
+    for k in np.flatnonzero(breach):
+        lbl1 = str(names[a['person'][k]]) + str(a['node'][k])
+        lbl2 = str(names[o['person'][k]]) + str(o['node'][k])
+        con1 = str(cons[a['person'][k]])
+        con2 = str(cons[o['person'][k]])
+        biggx.add_edge(lbl1, lbl2, breachnodes=(lbl1 + ':' + lbl2))
+        biggx.nodes[lbl1]['breached'] = 'yes'
+        biggx.nodes[lbl2]['breached'] = 'yes'
+        #there are no trajectory edges to hold the times of the locs, keep them on the locs
+        biggx.nodes[lbl1]['time'] = int(minutes_to_hhmm(a['time'][k]))
+        biggx.nodes[lbl2]['time'] = int(minutes_to_hhmm(o['time'][k]))
+        biggx.nodes[lbl1]['entry'] = int(a['entry'][k])
+        biggx.nodes[lbl1]['exit'] = int(a['exit'][k])
+        biggx.nodes[lbl2]['entry'] = int(o['entry'][k])
+        biggx.nodes[lbl2]['exit'] = int(o['exit'][k])
+        if(con1 == 'sick' or con2 == 'sick'):
+            high[k] = True
+            if(con1 == 'healthy'):
+                biggx.nodes[lbl1]['infec_start_loc'] = 'yes'
+            if(con2 == 'healthy'):
+                biggx.nodes[lbl2]['infec_start_loc'] = 'yes'
+    add_count('candidate_pairs', len(dists))
+    add_count('breaches', np.count_nonzero(breach))
+    add_count('high_risk', np.count_nonzero(high))
+
+    rows = {'dist': dists, 'breach': breach, 'high': high}
+    for (c, r) in (('1', a), ('2', o)):
+        for f in ('person', 'node', 'lat', 'lon', 'entry', 'exit'):
+            rows[f + c] = r[f]
+    return rows
+
+#contact tracing for populations that do not fit in memory. The csv at path is read in
+#chunks and its readings are spilled to disk partitioned by spatial cell and time bucket
+#(see spill_readings). Overlaps are then found one partition at a time and marked on
+#biggx. The travel history is written partition by partition, appended to histname + '.csv'
+#or as parts in the folder histname + '_npz' (see read_travel_hist). Only loc pairs that
+#overlap in time are compared, like time_sweep = 1. Returns the names of the known infected
+#people.
+@timed
+def stream_overlaps(path, histname):
+    printcov("Streaming ingest of: " + path + " in chunks of " + str(stream_chunk_rows()) + " rows.")
+    lon_scale = math.cos(math.radians(min(stream_max_lat(path), 90.0)))
+    cell_km = max(stream_partition_km, microcell_radius * 1.01)
+    spilldir = tempfile.mkdtemp(prefix='cov19_spill_', dir=(stream_spill_dir or None))
+    people = {'names': [], 'cons': []}
+    partitions = {}
+    try:
+        for store in stream_people(path, people):
+            spill_readings(store, cell_km, lon_scale, spilldir, partitions)
+        printcov("Spilled readings of " + str(len(people['names'])) + " people to " +
+            str(len(partitions)) + " partitions in: " + spilldir)
+
+        budget = stream_memory_mb * 1024 * 1024
+        hist = new_travel_hist(people['names'], people['cons'])
+        histpath = histname + '.csv'
+        if(travel_hist_format == 1):
+            histpath = histname + '_npz'
+            if(os.path.isdir(histpath)):
+                shutil.rmtree(histpath)
+            os.makedirs(histpath)
+        written = 0
+        parts = 0
+        for key in sorted(partitions):
+            (cy, cx, bucket) = key
+            readings = partitions[key] + sum(partitions.get((cy + dy, cx + dx, bucket), 0)
+                for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+            if(partition_bytes(readings) <= budget):
+                anchors = load_partition(spilldir, key, partitions)
+                others = np.concatenate([load_partition(spilldir, (cy + dy, cx + dx, bucket), partitions)
+                    for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+                joins = [join_partition(anchors, others, bucket, lon_scale)]
+            else:
+                #a row takes about 1 / nrows of the partition and its neighbours
+                nrows = min(int(math.ceil(partition_bytes(readings) / float(budget))) + 1,
+                    int(cell_km / (microcell_radius * 1.01)))
+                if(nrows <= 1 or partition_bytes(readings) / nrows > budget):
+                    printcov("Partition " + str(key) + " is over the memory budget even in rows of " +
+                        "sub-cells, lower stream_partition_km or stream_time_bucket.", log_warn)
+                nrows = max(nrows, 1)
+                printcov("Partition " + str(key) + " is over the memory budget, joining it in " +
+                    str(nrows) + " rows.")
+                joins = join_partition_rows(spilldir, key, partitions, cell_km, lon_scale, nrows)
+            for (a, o, dists) in joins:
+                append_travel_hist(hist, record_partition(a, o, dists, people))
+                if(travel_hist_size(hist) > 0):
+                    if(travel_hist_format == 0):
+                        travel_hist_frame(hist).to_csv(histpath, mode=('a' if written > 0 else 'w'),
+                            header=(written == 0))
+                    else:
+                        write_travel_hist_part(hist, histpath, parts)
+                    parts = parts + 1
+                    written = written + travel_hist_size(hist)
+                    hist['n'] = 0
+        if(travel_hist_format == 0 and written == 0):
+            travel_hist_frame(hist).to_csv(histpath)
+        if(travel_hist_format == 1):
+            write_travel_hist_people(hist, histpath)
+        printcov("Streamed " + str(written) + " travel histories to: " + histpath)
+    finally:
+        shutil.rmtree(spilldir, ignore_errors=True)
+
+    return [people['names'][p] for p in range(0, len(people['names'])) if people['cons'][p] == 'sick']
+
 #display graphs
 def disp_graph(g):
     if(ui == 0):
+        g = as_graph(g)
         nx.draw(g, with_labels=True)
         nx.draw_networkx_edge_labels(g, pos=nx.spring_layout(g))
         plt.show()
@@ -370,57 +2464,261 @@ def read_graph_from_pickle(picklepath):
     g = nx.read_gpickle(picklepath)
     return g
 
+#returns the sha1 of a file's contents
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+#returns the cache key of a stage given the key of the stage it depends on (or the
+#digest of the input file) and the configurations the stage depends on
+def stage_key(parent, config):
+    return hashlib.sha1(str((stage_cache_version, parent, config))).hexdigest()
+
+#returns the configurations the overlap stage depends on
+def overlap_config():
+    return (microcell_radius, spatial_index, time_sweep, distance_kernel, distance_kernel_rtol,
+        symmetric_pairs, mirror_travel_hist, travel_hist_breach_only, trajectory_store, graph_backend)
+
+#returns the folder of a stage's cached results
+def stage_folder(stage, key):
+    return os.path.join(stage_cache_dir, stage + '-' + key)
+
+#returns whether the stage cache has results for a stage. Always False with stage_cache = 0.
+def stage_hit(stage, key):
+    return stage_cache == 1 and os.path.isdir(stage_folder(stage, key))
+
+#saves the result of a stage to the stage cache with save(result, folder). Results are
+#written to a temp folder first and moved in place once complete, so an interrupted run
+#never leaves half a stage behind.
+def save_stage(stage, key, result, save):
+    if(stage_cache == 0):
+        return
+    if(not os.path.isdir(stage_cache_dir)):
+        os.makedirs(stage_cache_dir)
+    tmp = tempfile.mkdtemp(prefix='.' + stage + '-', dir=stage_cache_dir)
+    try:
+        save(result, tmp)
+        os.rename(tmp, stage_folder(stage, key))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    printcov("Saved stage: " + stage + " to: " + stage_folder(stage, key))
+
+#runs a stage through the stage cache. On a hit its results are loaded with load(folder),
+#otherwise compute() is run and its result saved with save(result, folder).
+def cached_stage(stage, key, compute, save, load):
+    if(stage_hit(stage, key)):
+        printcov("Loading stage: " + stage + " from: " + stage_folder(stage, key))
+        return load(stage_folder(stage, key))
+    result = compute()
+    save_stage(stage, key, result, save)
+    return result
+
+#saves / loads the prepp'd data stage
+def save_prep(df, folder):
+    df.to_pickle(os.path.join(folder, 'preppd_df.pkl'))
+
+def load_prep(folder):
+    df = pd.read_pickle(os.path.join(folder, 'preppd_df.pkl'))
+    #dataprep also finds the people of the population
+    persons.extend(df['name'].unique())
+    return df
+
+#saves / loads the trajectory store stage
+def save_store(store, folder):
+    arrays = dict((c, store[c]) for c in ('offsets', 'lat', 'lon', 'time', 'entry', 'exit'))
+    np.savez(os.path.join(folder, 'store.npz'), names=np.array(store['names']),
+        cons=np.array(store['cons']), **arrays)
+
+def load_store(folder):
+    data = np.load(os.path.join(folder, 'store.npz'))
+    store = dict((c, data[c]) for c in ('offsets', 'lat', 'lon', 'time', 'entry', 'exit'))
+    store['names'] = data['names'].tolist()
+    store['cons'] = data['cons'].tolist()
+    return store
+
+#saves / loads the overlap stage, biggx and the travel history
+def save_overlaps(result, folder):
+    (g, hist) = result
+    if(isinstance(g, dict)):
+        save_contact_graph(g, os.path.join(folder, 'graph.npz'))
+    else:
+        save_graph_to_pickle(g, os.path.join(folder, 'graph.gz'))
+    write_travel_hist_npz(hist, os.path.join(folder, 'travelhist_df.npz'))
+
+def load_overlaps(folder):
+    hist = read_travel_hist(os.path.join(folder, 'travelhist_df.npz'))
+    if(os.path.exists(os.path.join(folder, 'graph.npz'))):
+        return read_contact_graph(os.path.join(folder, 'graph.npz')), hist
+    return read_graph_from_pickle(os.path.join(folder, 'graph.gz')), hist
+
+@timed
 def find_infection_start_locs(g):
-    nattrib_infec_start_loc = nx.get_node_attributes(g,'infec_start_loc')
-    printcov("Infection start locations for healthy people are: \n" + str(nattrib_infec_start_loc))
+    if(isinstance(g, dict)):
+        nattrib_infec_start_loc = dict((n, 'yes') for n in contact_labels(g, np.flatnonzero(g['infec'])))
+    else:
+        nattrib_infec_start_loc = nx.get_node_attributes(g,'infec_start_loc')
+    #a dump of every infected loc, only built when it is printed
+    if(log_level >= log_info):
+        printcov("Infection start locations for healthy people are: \n" + str(nattrib_infec_start_loc))
     return nattrib_infec_start_loc
 
-def find_high_traffic_locations(g):
-    node_deg = dict(nx.degree(g))
-    sorted_nodedeg = [(k, node_deg[k]) for k in sorted(node_deg, key=node_deg.get, reverse=True)]
-    top5nodes_by_deg = []
-    top5nodes_by_deg.append(sorted_nodedeg[0])
-    top5nodes_by_deg.append(sorted_nodedeg[1])
-    top5nodes_by_deg.append(sorted_nodedeg[2])
-    top5nodes_by_deg.append(sorted_nodedeg[3])
-    top5nodes_by_deg.append(sorted_nodedeg[4])
-
-    di = nx.get_node_attributes(g,'breached')
+#returns the high_traffic_top_k breached locs with the most connections, as (loc, degree)
+#pairs from the highest degree down. Only breached locs are looked at and a heap of k of
+#them is kept, so this is O(n log k) and works with fewer than k locs.
+@timed
+def find_high_traffic_locations(g, k=None):
+    if(k is None):
+        k = high_traffic_top_k
+    if(isinstance(g, dict)):
+        deg = contact_degree(g)
+        top = heapq.nlargest(k, np.flatnonzero(g['breached']).tolist(), key=deg.__getitem__)
+        htl = list(zip(contact_labels(g, top), [int(deg[i]) for i in top]))
+    else:
+        breached = (n for (n, b) in g.nodes(data='breached') if b is not None)
+        htl = heapq.nlargest(k, ((n, g.degree(n)) for n in breached), key=lambda nd: nd[1])
 
     printcov("These locations have witnessed high traffic: ")
-    htl = []
-    for n in g.nodes:
-        for n2 in top5nodes_by_deg:
-            if(n == n2[0]):
-                for n3 in di:
-                    if(n2[0] == n3):
-                        print(str(n3))
-                        htl.append(n3)
+    for (n, d) in htl:
+        printlog(str(n) + " (" + str(d) + ")")
     return htl
 
-def predict_next_infec_locations(g):
-    neighb_nodes=[]
-
-    infec_start_locs = nx.get_node_attributes(g,'infec_start_loc')
-    for n in infec_start_locs:
-        neighb = nx.all_neighbors(g,n)
-        for nebs in neighb:
-            neighb_nodes.append(nebs)
-
-    #we can also order these location edges by time by keeping locs that come into play
-    #only after the 'infec_start_loc' time. This keeps predicted locs that were traveled
-    #to only after an infection occured. The below is a more generic set.
-    printcov("Predicted locations where infections may have occurred (time agnostic): ")
-    print(neighb_nodes)
+#returns the loc graph predict_next_infec_locations works on, with locs numbered in node
+#order, for biggx or a contact graph: 'labels' of the locs, 'entry' / 'exit' minutes of
+#each loc, 'next' loc of the same person (-1 for their last one), 'sick' whether the loc's
+#person is in infected and the breach neighbours of each loc as CSR arrays 'indptr' /
+#'indices'. A loc is entered at the time it was recorded, not at the 0 the trajectory store
+#has for a person's first loc, so the same windows find_exposures uses. biggx holds the
+#times on its locs and on its trajectory edges. The biggx of streaming ingest has only the
+#breached locs, with their times on the locs (see record_partition), a person's next loc
+#there is their next breached one. The exit of a person's last loc is not known and stays
+#0, like in the travel history, so no contact is found there.
+def temporal_graph(g, infected):
+    if(isinstance(g, dict)):
+        offsets = g['offsets']
+        nnodes = len(g['lat'])
+        person = np.repeat(np.arange(store_size(g)), np.diff(offsets))
+        nxt = np.arange(1, nnodes + 1)
+        nxt[offsets[1:][offsets[1:] > 0] - 1] = -1
+        rows = np.repeat(np.arange(nnodes), np.diff(g['indptr']))
+        keep = person[rows] != person[g['indices']]
+        indptr = np.zeros(nnodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows[keep], minlength=nnodes))
+        sick = np.array([str(n) in infected for n in g['names']], dtype=bool)[person]
+        return {'labels': contact_labels(g), 'entry': g['time'], 'exit': g['exit'],
+            'next': nxt, 'sick': sick, 'indptr': indptr, 'indices': g['indices'][keep]}
+
+    labels = list(g.nodes)
+    index = dict((l, i) for (i, l) in enumerate(labels))
+    entry = np.zeros(len(labels), dtype=np.int32)
+    exit = np.zeros(len(labels), dtype=np.int32)
+    nxt = np.full(len(labels), -1, dtype=np.int64)
+    src = []
+    dst = []
+    for (u, v, d) in g.edges(data=True):
+        (i, j) = (index[u], index[v])
+        if('breachnodes' in d):
+            src.extend((i, j))
+            dst.extend((j, i))
+        elif('time' in d):
+            #trajectory edges have the time of the later loc
+            if(int(str(u)[len(label_name(u)):]) > int(str(v)[len(label_name(v)):])):
+                (i, j) = (j, i)
+            nxt[i] = j
+            entry[j] = hhmm_to_minutes(int(d['time']))
+            exit[i] = entry[j]
+    streamed = {}
+    for (l, d) in g.nodes(data=True):
+        if('entry' in d):
+            i = index[l]
+            entry[i] = d['entry']
+            exit[i] = d['exit']
+            streamed.setdefault(label_name(l), []).append((int(str(l)[len(label_name(l)):]), i))
+        #graphs saved before locs had their time only have it on the trajectory edges
+        if('time' in d):
+            entry[index[l]] = hhmm_to_minutes(int(d['time']))
+    for locs in streamed.values():
+        locs.sort()
+        for k in range(1, len(locs)):
+            nxt[locs[k - 1][1]] = locs[k][1]
+    if(len(src) > 0 and len(streamed) == 0 and not np.any(nxt >= 0)):
+        printcov("The graph has no times of its locs, every loc is taken to be visited all day.", log_warn)
+        exit[:] = 24 * 60 - 1
+    src = np.array(src, dtype=np.int64)
+    order = np.argsort(src, kind='mergesort')
+    indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=len(labels)))
+    sick = np.array([label_name(l) in infected for l in labels], dtype=bool)
+    return {'labels': labels, 'entry': entry, 'exit': exit, 'next': nxt, 'sick': sick,
+        'indptr': indptr, 'indices': np.array(dst, dtype=np.int64)[order]}
+
+#earliest arrival of an infection at every loc of a temporal graph (see temporal_graph)
+#reachable from the locs of sick people within max_hops contacts. Sick people are
+#infectious at all of their locs from the time they get there. Infection follows
+#trajectory edges forward in time, as the person carries it on to their next loc, and
+#breach edges only while both people are at their locs at the same time, one hop per
+#breach. Locs come off a priority queue by earliest arrival, like dijkstra. A loc is
+#taken again later only if it is reached in fewer hops, as that may go further.
+#Returns a dict of loc -> (earliest arrival in minutes of the day, hops).
+def temporal_reach(tg, max_hops):
+    entry = tg['entry'].tolist()
+    exit = tg['exit'].tolist()
+    nxt = tg['next'].tolist()
+    ptr = tg['indptr'].tolist()
+    nbs = tg['indices'].tolist()
+
+    heap = [(entry[i], 0, i) for i in np.flatnonzero(tg['sick']).tolist()]
+    heapq.heapify(heap)
+    arrival = {}
+    besthops = {}
+    while(len(heap) > 0):
+        (a, h, i) = heapq.heappop(heap)
+        if(besthops.get(i, max_hops + 1) <= h):
+            continue
+        besthops[i] = h
+        if(i not in arrival):
+            arrival[i] = (a, h)
+        if(nxt[i] >= 0):
+            heapq.heappush(heap, (max(a, entry[nxt[i]]), h, nxt[i]))
+        if(h < max_hops):
+            for e in range(ptr[i], ptr[i + 1]):
+                j = nbs[e]
+                t = max(a, entry[j])
+                if(t <= min(exit[i], exit[j])):
+                    heapq.heappush(heap, (t, h + 1, j))
+    return arrival
+
+#predicts the locs where infections may have occurred, in the order they may have. These are
+#the locs reached from the known infected within predict_max_hops contacts, taking the time
+#of every loc into account (see temporal_reach). infected defaults to known_infected_list.
+#Returns (loc, earliest HHMM it may have been infected, hops) from the earliest on.
+@timed
+def predict_next_infec_locations(g, infected=None):
+    if(infected is None):
+        infected = known_infected_list
+    tg = temporal_graph(g, set(label_name(p) for p in infected))
+    arrival = temporal_reach(tg, predict_max_hops)
+    reached = sorted((a, h, tg['labels'][i]) for (i, (a, h)) in arrival.items() if h > 0)
+    neighb_nodes = [(n, int(minutes_to_hhmm(a)), h) for (a, h, n) in reached]
+
+    printcov("Predicted locations where infections may have occurred, with the earliest time " +
+        "and the number of contacts from a known infected (up to " + str(predict_max_hops) + "): ")
+    printlog(neighb_nodes)
 
     return neighb_nodes
 
 #note: this function plots a graph if ui is enabled
+@timed
 def find_communities_based_on_loc(g):
 
-    #first compute the best partition
+    #first compute the best partition. A contact graph is partitioned on its arrays.
     G = g
-    partition = community.best_partition(G)
+    if(isinstance(g, dict)):
+        partition = dict(zip(contact_labels(g), contact_louvain(g).tolist()))
+    else:
+        partition = community.best_partition(G)
 
     comm_list = []    
     size = float(len(set(partition.values())))
@@ -432,6 +2730,7 @@ def find_communities_based_on_loc(g):
         comm_list.append(list_nodes)
 
     if(ui == 0):
+        G = as_graph(g)
         plt.figure(101,(17,17))
         pos = nx.spring_layout(G)
         nclr = range(len(list_nodes))
@@ -440,95 +2739,198 @@ def find_communities_based_on_loc(g):
         nx.draw_networkx_edges(G, pos, alpha=0.5)
         plt.show()
 
-    printcov("Final list of: " + len(comm_list) + " louvain modularized communities :=>\n")
+    printcov("Final list of: " + str(len(comm_list)) + " louvain modularized communities :=>\n")
     for x in comm_list:
-        print(x)
+        printlog(x)
     
     return comm_list
 
-def find_vuln_loc_and_ppl(comm_list, infperson):
-
-    vulncomm = [] #list of vulnerable locations
-    for comm in comm_list:
-        for p in comm:
-            onlyname = ''.join([i for i in p if not i.isdigit()])
-            if(onlyname == infperson):
-                vulncomm.append(comm)
-                break
+#returns the name of the person of a loc (graph node) label
+def label_name(label):
+    return str(label).rstrip('0123456789')
+
+#indexes louvain communities (see find_communities_based_on_loc) both ways. 'comms' maps
+#a person to the numbers of the communities their locs are in, 'people' holds the people
+#of each community. Built once, it answers find_vuln_loc_and_ppl for any infected person
+#without going through the communities again.
+def index_communities(comm_list):
+    comms = {}
+    people = []
+    for (c, comm) in enumerate(comm_list):
+        names = set(label_name(x) for x in comm)
+        for name in names:
+            comms.setdefault(name, []).append(c)
+        people.append(names)
+    return {'comms': comms, 'people': people}
+
+#returns the communities the infected person has been in and the people of those
+#communities. commidx is the index of comm_list, it is built if not given.
+def find_vuln_loc_and_ppl(comm_list, infperson, commidx=None):
+    if(commidx is None):
+        commidx = index_communities(comm_list)
+
+    incomms = commidx['comms'].get(infperson, [])
+    vulncomm = [comm_list[c] for c in incomms] #list of vulnerable locations
     printcov("Priority list of vulnerable locations are: ")
-    print(vulncomm)
-    
-    vulnppl1 = []
-    for x in vulncomm:
-        for j in range(0,len(x)):
-            onlyname = ''.join([i for i in x[j] if not i.isdigit()])
-            vulnppl1.append(onlyname)
+    printlog(vulncomm)
 
     printcov("Vulnerable people are: ")
-    vulnppl = list(set(vulnppl1))
-    print(vulnppl)
+    vulnppl = list(set().union(*[commidx['people'][c] for c in incomms]))
+    printlog(vulnppl)
 
     return vulncomm, vulnppl
 
+#find_vuln_loc_and_ppl for every infected person, with one index of the communities.
+#Returns a dict of infected person -> (vulnerable locations, vulnerable people).
+@timed
+def find_vuln_for_infected(comm_list, infpersons):
+    commidx = index_communities(comm_list)
+    vuln = {}
+    for infp in infpersons:
+        onlyname = label_name(infp)
+        vuln[onlyname] = find_vuln_loc_and_ppl(comm_list, onlyname, commidx)
+    return vuln
+
 def find_known_infected_ppl(g):
     printcov("We have: " + str(len(known_infected_list)) + " known infected people in this dataset. They are: ")
-    print(known_infected_list)
+    printlog(known_infected_list)
     return known_infected_list
 
+#runs the graph analysis on g and returns its results as a dict of 'infected' people,
+#'infec_start_locs', 'high_traffic' locs, 'predicted' infection locs, louvain 'communities'
+#and 'vulnerable' locs and people per infected person
+@timed
 def run_graph_analysis(g):
     
     infperson_lst = find_known_infected_ppl(g)
     
-    find_infection_start_locs(g)
+    infec_start_locs = find_infection_start_locs(g)
     
-    find_high_traffic_locations(g)
+    htl = find_high_traffic_locations(g)
     
-    predict_next_infec_locations(g)
+    predicted = predict_next_infec_locations(g, infperson_lst)
     
     comm_list = find_communities_based_on_loc(g)
 
-    for infp in infperson_lst:
-        onlyname = ''.join([i for i in infp if not i.isdigit()])
-        find_vuln_loc_and_ppl(comm_list, onlyname)
+    vuln = find_vuln_for_infected(comm_list, infperson_lst)
 
-    return
+    return {'infected': infperson_lst, 'infec_start_locs': infec_start_locs, 'high_traffic': htl,
+        'predicted': predicted, 'communities': comm_list, 'vulnerable': vuln}
 
 ################
 ##### MAIN #####
 ################
-printcov("Starting Covid 19 contact tracing analysis for data in: ")
-printcov(" " + datapath)
-printcov("Configurations are: ")
-print("Microcell radius for overlap calc: " + str(microcell_radius))
-print("Graph display control is: " + str(ui) + ".   0 = ON / 1 = OFF.")
-print('-------------------------------------')
-time.sleep(7.7)
-
-#call dataprep method. We also get 'persons' during this
-sorteddf = dataprep()
-
-known_infected_list = (sorteddf.loc[sorteddf['condition'] == 'sick'])['name'].unique()
-printcov("We have: " + str(len(known_infected_list)) + " known infected people in this dataset. They are: ")
-print(known_infected_list)
-
-#call graph generation method for each person in the dataset
-print("Initiating graph generation...")
-for person in range(0,len(persons)):
-    graph_per_person(persons[person])
-
-test_all_graphs(gxarry_pop_travel_hist)
-
-biggx = build_bigdaddy(gxarry_pop_travel_hist)
-
-travel_hist = overlaps_for_pop(gxarry_pop_travel_hist)
-printcov("There are : " + str(len(travel_hist)) + " travel histories. They are: ")
-print(travel_hist)
-#save travel hist for later use
-travel_hist.to_csv("travelhist_df.csv")
-disp_graph(biggx)
-
-save_graph_to_pickle(biggx, "graph.gz")
+if __name__ == '__main__':
+    printcov("Starting Covid 19 contact tracing analysis for data in: ")
+    printcov(" " + datapath)
+    printcov("Configurations are: ")
+    printlog("Microcell radius for overlap calc: " + str(microcell_radius))
+    printlog("Graph display control is: " + str(ui) + ".   0 = ON / 1 = OFF.")
+    printlog("Log level is: " + str(log_level) + ".   0 = warnings / 1 = progress / 2 = debug.")
+    printlog('-------------------------------------')
+    time.sleep(startup_pause)
+
+    if(incremental_state_dir != '' and (stream_ingest == 1 or len(microcell_radii) > 0)):
+        #no state would be saved and the next run would take its batch for a full dataset
+        raise ValueError("Incremental tracing does not work with streaming ingest or microcell_radii.")
+
+    if(stream_ingest == 1):
+        #the graph is built up with the breaches found, one partition at a time
+        biggx = nx.MultiGraph()
+        known_infected_list = stream_overlaps(datapath, "travelhist_df")
+        printcov("We have: " + str(len(known_infected_list)) + " known infected people in this dataset. They are: ")
+        printlog(known_infected_list)
+    elif(incremental_state_dir != '' and os.path.isdir(incremental_state_dir)):
+        #only the new readings are traced against the saved state
+        printcov("Tracing new readings against the state in: " + incremental_state_dir)
+        tracestate = load_trace_state(incremental_state_dir)
+        (travel_hist, newsick) = trace_new_readings(tracestate, pd.read_csv(datapath, sep=',', header=0))
+        for name in condition_updates:
+            set_condition(tracestate, name, condition_updates[name], travel_hist)
+        save_trace_state(tracestate, incremental_state_dir)
+        trajstore = tracestate['store']
+        biggx = tracestate['graph']
+        known_infected_list = [trajstore['names'][p] for p in range(0, store_size(trajstore))
+            if trajstore['cons'][p] == 'sick']
+        printcov("New known infected people: " + str(newsick))
+        save_travel_hist(travel_hist, "travelhist_df")
+        if(exposure_stage == 1):
+            save_exposures(travel_hist, trajstore, "exposure_df")
+    else:
+        #call dataprep method. We also get 'persons' during this
+        prepkey = ''
+        if(stage_cache == 1):
+            prepkey = stage_key(file_digest(datapath), 'prep')
+        sorteddf = cached_stage('prep', prepkey, dataprep, save_prep, load_prep)
+
+        known_infected_list = (sorteddf.loc[sorteddf['condition'] == 'sick'])['name'].unique()
+        printcov("We have: " + str(len(known_infected_list)) + " known infected people in this dataset. They are: ")
+        printlog(known_infected_list)
+
+        overlapkey = stage_key(prepkey, overlap_config())
+        if(len(microcell_radii) == 0 and stage_hit('overlaps', overlapkey)):
+            #nothing the overlaps depend on has changed, straight to the analysis
+            (biggx, travel_hist) = load_overlaps(stage_folder('overlaps', overlapkey))
+            printcov("Loaded overlaps from: " + stage_folder('overlaps', overlapkey))
+        else:
+            #call graph generation method for each person in the dataset, or
+            #build the trajectory store of the population instead
+            if(trajectory_store == 1):
+                trajstore = cached_stage('store', stage_key(prepkey, 'store'),
+                    lambda: build_trajectory_store(sorteddf), save_store, load_store)
+                population = trajstore
+            else:
+                printlog("Initiating graph generation...")
+                for person in range(0,len(persons)):
+                    graph_per_person(persons[person])
+                population = gxarry_pop_travel_hist
+
+            test_all_graphs(population)
+
+            if(distance_kernel == 1 and verify_distance_kernel == 1):
+                check_distance_kernel(population)
+
+            if(len(microcell_radii) > 0):
+                #one overlap pass for all radii, each radius is saved and analysed on its own
+                overlaps_for_radii(population, microcell_radii)
+            else:
+                if(graph_backend == 1):
+                    travel_hist = overlaps_for_pop(population)
+                    biggx = build_contact_graph(as_store(population), travel_hist)
+                else:
+                    biggx = build_bigdaddy(population)
+                    travel_hist = overlaps_for_pop(population)
+                save_stage('overlaps', overlapkey, (biggx, travel_hist), save_overlaps)
+
+        if(len(microcell_radii) == 0):
+            printcov("There are : " + str(travel_hist_size(travel_hist)) + " travel histories. The first ones are: ")
+            printlog(travel_hist_frame(travel_hist, 0, 27))
+            #save travel hist for later use
+            save_travel_hist(travel_hist, "travelhist_df")
+
+            if((exposure_stage == 1 or incremental_state_dir != '') and len(trajstore) == 0):
+                #per person graphs were used or the overlaps came from the stage cache
+                trajstore = cached_stage('store', stage_key(prepkey, 'store'),
+                    lambda: build_trajectory_store(sorteddf), save_store, load_store)
+
+            if(incremental_state_dir != ''):
+                #starting state for tracing new readings later on
+                save_trace_state(new_trace_state(trajstore, as_graph(biggx)), incremental_state_dir)
+
+            if(exposure_stage == 1):
+                exposures = save_exposures(travel_hist, trajstore, "exposure_df")
+
+    if(stream_ingest == 1 or len(microcell_radii) == 0):
+        disp_graph(biggx)
+
+        if(isinstance(biggx, dict)):
+            save_contact_graph(biggx, "graph.npz")
+        else:
+            save_graph_to_pickle(biggx, "graph.gz")
 
-run_graph_analysis(biggx)
+        analysis = run_graph_analysis(biggx)
+        if(exposures is not None):
+            test_predictions(analysis['predicted'], exposures)
 
-printcov("Completed Covid 19 contact tracing analysis.")
+    save_run_stats("run_stats.json")
+    printcov("Completed Covid 19 contact tracing analysis.")
@@ -22,6 +22,8 @@ Dependencies:
  - Python 2.7 only (latlon doesn't support Python 3 :(.)
  - LatLon 1.0.2 - https://pypi.org/project/LatLon/
  - pandas 0.24.2
+ - numpy 1.16
+ - pyproj 1.9.6 (installed with LatLon)
  
 """
 
@@ -29,7 +31,13 @@ import random
 import decimal
 import string
 import datetime
+import gzip
+import json
+import os
+import multiprocessing
 import pandas as pd
+import numpy as np
+import pyproj
 import LatLon
 from LatLon import *
 import time
@@ -88,6 +96,36 @@ total_linger_start_loc = 7
 #vendors etc).
 linger_mov_angle_mulfactor = 15
 
+#controls how the data is generated. 0 = one reading at a time per person (see generate_dyndata).
+#1 = batch generation, all readings of the whole population are generated at once as numpy
+#arrays (see batch_datagen). Same kind of data, generated a lot faster for large populations.
+batch_gen = 1
+
+#number of people generated at a time by batch generation. Each batch is written out as soon
+#as it is generated so memory stays the same whatever the size of the population. Rounded down
+#to whole shards of gen_shard_size people, at least one. Does not change the data generated.
+gen_batch_size = 10000
+
+#format the data is written in by batch generation. 0 = cov19_gen_dataset.csv. 1 = gzip'd csv,
+#cov19_gen_dataset.csv.gz. 2 = binary columnar, one raw file per column in the folder
+#cov19_gen_dataset_cols (see write_columnar_batches).
+gen_output_format = 0
+
+#seed of batch generation. The same seed and configuration always generate the same data,
+#whatever the batch size and the number of workers. 0 = a new random seed each run, it
+#is printed so the run can be repeated.
+gen_seed = 0
+
+#date written with every reading. '' = today's date. Set it (e.g. '27-05-2020') together with
+#gen_seed to regenerate a dataset byte for byte on another day.
+gen_date = ''
+
+#number of worker processes batch generation is spread over. 1 = everything runs in this process.
+gen_workers = 1
+
+#seconds the configurations are shown for before generation starts. 0 = start right away.
+startup_pause = 7
+
 ##### all configurables end here #####
 
 #dataframe that holds all regiemented (linger) start locations
@@ -215,59 +253,304 @@ def random_datagen(name, condition):
 	#print(dfrandom)
 	return dfrandom
 
-##### main #####
-
-print("Configurations are: ")
-print("------------------------------------")
-print("Total population: " + str(total_pop))
-print("Max sick allowed: " + str(no_of_sick_allowed))
-print("Total location readings per person: " + str(total_readings))
-print("Geo location bounding box coordinates are: ")
-print(str(latstart))
-print(str(latend))
-print(str(lonstart))
-print(str(lonend))
-print("Time range of location readings are: ")
-print(str(timehr_range_start))
-print(str(timehr_range_end))
-print(str(timemm_range_start))
-print(str(timemm_range_end))
-print("Number of start locations to be generated for regimented loc paths: " + str(total_linger_start_loc))
-print("Regimented loc path move bearing factor: " + str(linger_mov_angle_mulfactor))
-print('-------------------------------------')
-time.sleep(7)
-
-print("Starting generation of data ...")
-reglocdf = gen_reg_start_loc(total_linger_start_loc)
-print("Regimented start locations are: ")
-print(reglocdf)
-
-for p in range(0, total_pop):
-	name = ''.join(random.choice(string.ascii_uppercase) for _ in range(name_size))
-	#print(name)
-	condition = "healthy"
-	if(mark_sick==0):
-		con = random.randint(10,20)
-		if(con>=15):
-			condition = "sick"
-			curr_sick = curr_sick + 1
-			if(curr_sick>=no_of_sick_allowed):
-				mark_sick = 1
-
-	#print("Person: " + name + " is: " + condition)
-	if(glinger):
-		glinger = False
+#distance in km a lingering person moves between two readings
+linger_step_km = 0.002
+
+#number of people of a shard of batch generation. Every shard has its own random streams (see
+#gen_rng) and batches are made of whole shards, so the data only depends on the seed and the
+#configuration, not on gen_batch_size. Changing it changes the data generated for a seed.
+gen_shard_size = 1000
+
+#generates the unique names of people first to first + n - 1. A person's index is mapped
+#to a name by a random one to one scramble of all name_size letter names (namekey holds
+#its two factors, see gen_name_key), so names never repeat, whatever the batch they are
+#generated in.
+def gen_names_batch(first, n, namekey):
+	(mul, add) = namekey
+	space = 26 ** name_size
+	codes = (np.arange(first, first + n, dtype=np.int64) * mul + add) % space
+	letters = np.zeros((n, name_size), dtype=np.uint8)
+	for c in range(name_size - 1, -1, -1):
+		letters[:, c] = codes % 26 + ord('A')
+		codes = codes // 26
+	return letters.view('S' + str(name_size)).ravel()
+
+#draws the two factors of the name scramble. The multiplier has no factor in common with
+#26 so every index below 26 ** name_size gets its own name.
+def gen_name_key(rng):
+	space = 26 ** name_size
+	mul = int(rng.randint(1, space // 26)) * 26 + 1
+	return (mul, int(rng.randint(0, space)))
+
+#draws which of n people would be sick if there was no limit, same draw as the main loop
+def gen_sick_draws(n, rng):
+	return rng.randint(10, 21, size=n) >= 15
+
+#returns the condition of people given their sick draws. Same rule as the main loop, people
+#are marked sick one after another till no_of_sick_allowed is reached. sick_before is the
+#number of people already marked sick before these ones.
+def gen_conditions_batch(sickdraws, sick_before=0):
+	sick = sickdraws & (sick_before + np.cumsum(sickdraws) <= no_of_sick_allowed)
+	return np.where(sick, 'sick', 'healthy')
+
+#draws n random HHMM times in the configured time range, as minutes of the day
+def gen_times_batch(n, rng):
+	timehr = rng.randint(timehr_range_start, timehr_range_end + 1, size=n)
+	timemm = rng.randint(timemm_range_start, timemm_range_end + 1, size=n)
+	return timehr * 60 + timemm
+
+#draws n random coordinates in the configured geo location bounding box
+def gen_locs_batch(n, rng):
+	lat = rng.randint(latstart, latend, size=n) / 1000000.0
+	lon = rng.randint(lonstart, lonend, size=n) / 1000000.0
+	return lat, lon
+
+#generates the readings of people first to first + npeople - 1 in one go. Every other
+#person lingers, starting with the first one, and the linger start locations (startlocs)
+#are handed out in turn like in the main loop. sickdraws are the sick draws of these people
+#(see gen_sick_draws). Returns a dataframe with the same columns and layout as the main loop.
+def batch_datagen(first, npeople, startlocs, namekey, rng, sickdraws, sick_before=0):
+	(startlat, startlon) = startlocs
+	people = np.arange(first, first + npeople)
+	names = gen_names_batch(first, npeople, namekey)
+	conditions = gen_conditions_batch(sickdraws, sick_before)
+	linger = people % 2 == 0
+	locindx = people % len(startlat)
+	nlinger = int(linger.sum())
+
+	lat = np.zeros((npeople, total_readings))
+	lon = np.zeros((npeople, total_readings))
+	mins = np.zeros((npeople, total_readings), dtype=np.int64)
+
+	#passthru: random locations against random timeframes
+	npass = npeople - nlinger
+	(plat, plon) = gen_locs_batch(npass * total_readings, rng)
+	lat[~linger] = plat.reshape(npass, total_readings)
+	lon[~linger] = plon.reshape(npass, total_readings)
+	mins[~linger] = gen_times_batch(npass * total_readings, rng).reshape(npass, total_readings)
+
+	#linger: a path from the start loc along the bearing of the start loc, one reading a
+	#minute. All lingering people take a step at once, same as LatLon's offset does.
+	geod = pyproj.Geod(ellps='WGS84')
+	bearing = (locindx[linger] * linger_mov_angle_mulfactor).astype(np.float64)
+	llat = np.zeros((nlinger, total_readings))
+	llon = np.zeros((nlinger, total_readings))
+	llat[:, 0] = startlat[locindx[linger]]
+	llon[:, 0] = startlon[locindx[linger]]
+	for r in range(1, total_readings):
+		(nlon, nlat, back) = geod.fwd(llon[:, r - 1], llat[:, r - 1], bearing,
+			np.full(nlinger, linger_step_km * 1000), radians=False)
+		llat[:, r] = nlat
+		llon[:, r] = nlon
+	lat[linger] = llat
+	lon[linger] = llon
+	mins[linger] = (gen_times_batch(nlinger, rng)[:, None] + np.arange(total_readings)) % 1440
+
+	date = gen_date
+	if(date == ''):
+		date = datetime.datetime.now().strftime("%d-%m-%Y")
+	return pd.DataFrame({'name': np.repeat(names, total_readings),
+		'lat': lat.ravel(), 'lon': lon.ravel(), 'date': date,
+		'time': (mins // 60 * 100 + mins % 60).ravel(),
+		'condition': np.repeat(conditions, total_readings)},
+		columns=col_names, index=np.tile(np.arange(total_readings), npeople))
+
+#returns the random number generator of a stream of a run. Every shard has its own streams,
+#derived from the seed and the shard number only, so a shard comes out the same whichever
+#batch and process generates it. Stream 0 of shard -1 is used for the draws shared by all.
+def gen_rng(seed, shard, stream):
+	return np.random.RandomState([seed, shard + 1, stream])
+
+#returns the seed of the run, a new random one if gen_seed is 0
+def gen_run_seed():
+	if(gen_seed != 0):
+		return gen_seed
+	return random.SystemRandom().randint(1, 2 ** 31 - 1)
+
+#plans the batches of a run of npeople. The population is cut in shards of gen_shard_size
+#people and returns one task per batch of gen_batch_size people (whole shards), as the
+#arguments of gen_batch_task. The sick draws of every shard are made here first (they are
+#cheap) so each shard knows how many people were marked sick before it.
+def plan_batches(npeople, seed):
+	shared = gen_rng(seed, -1, 0)
+	startlocs = gen_locs_batch(min(total_linger_start_loc, 24), shared) #sanity!
+	namekey = gen_name_key(shared)
+	shards = []
+	sick_before = 0
+	for (s, first) in enumerate(range(0, npeople, gen_shard_size)):
+		n = min(gen_shard_size, npeople - first)
+		shards.append((s, first, n, sick_before))
+		sick_before = sick_before + int(gen_sick_draws(n, gen_rng(seed, s, 1)).sum())
+	per = max(1, gen_batch_size // gen_shard_size)
+	return [(seed, shards[b:b + per], startlocs, namekey) for b in range(0, len(shards), per)]
+
+#generates one planned batch (see plan_batches), shard by shard. Runs in a worker process
+#in parallel mode.
+def gen_batch_task(task):
+	(seed, shards, startlocs, namekey) = task
+	return pd.concat([batch_datagen(first, n, startlocs, namekey, gen_rng(seed, s, 0),
+		gen_sick_draws(n, gen_rng(seed, s, 1)), sick_before) for (s, first, n, sick_before) in shards])
+
+#yields the readings of the whole population, gen_batch_size people at a time, so only
+#a few batches are ever held in memory. With gen_workers > 1 the batches are generated by
+#a pool of processes and yielded in order. The output only depends on the seed and the
+#configuration, not on the number of workers.
+def gen_population_batches(npeople, seed):
+	tasks = plan_batches(npeople, seed)
+	if(gen_workers <= 1):
+		for task in tasks:
+			yield gen_batch_task(task)
+		return
+
+	print("Generating batches with " + str(gen_workers) + " worker processes.")
+	pool = multiprocessing.Pool(gen_workers)
+	try:
+		#a window of batches at a time keeps finished batches from piling up in memory
+		window = 2 * gen_workers
+		for w in range(0, len(tasks), window):
+			for df in pool.imap(gen_batch_task, tasks[w:w + window]):
+				yield df
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+#dtypes of the columns of the binary columnar output, see write_columnar_batches. name is
+#a fixed size string, time is HHMM and condition is 1 for sick and 0 for healthy.
+col_dtypes = {'name': 'S' + str(name_size), 'lat': '<f8', 'lon': '<f8', 'time': '<i4', 'condition': '|u1'}
+
+#writes batches of readings to filename as they come, in the csv layout. With compress
+#the csv is gzip'd. Returns the path written.
+def write_csv_batches(batches, filename, compress=False):
+	path = filename + '.csv'
+	if(compress):
+		path = path + '.gz'
+		f = gzip.open(path, 'wb')
 	else:
-		glinger = True
+		f = open(path, 'wb')
+	try:
+		header = True
+		for df in batches:
+			#coordinates are written with the precision LatLon prints them with
+			df.to_csv(f, header=header, float_format='%.12g')
+			header = False
+	finally:
+		f.close()
+	return path
+
+#writes batches of readings as they come to the folder filename + '_cols', one raw
+#binary file per column (see col_dtypes) plus meta.json with the dtypes, the date and
+#the number of readings. read_columnar_dataset loads it back. Returns the folder.
+def write_columnar_batches(batches, filename):
+	folder = filename + '_cols'
+	if(not os.path.isdir(folder)):
+		os.makedirs(folder)
+	files = dict((c, open(os.path.join(folder, c + '.bin'), 'wb')) for c in col_dtypes)
+	rows = 0
+	date = ''
+	try:
+		for df in batches:
+			date = df['date'].values[0]
+			files['name'].write(df['name'].values.astype(col_dtypes['name']).tobytes())
+			files['lat'].write(df['lat'].values.astype(col_dtypes['lat']).tobytes())
+			files['lon'].write(df['lon'].values.astype(col_dtypes['lon']).tobytes())
+			files['time'].write(df['time'].values.astype(col_dtypes['time']).tobytes())
+			files['condition'].write((df['condition'].values == 'sick').astype(col_dtypes['condition']).tobytes())
+			rows = rows + len(df)
+	finally:
+		for c in files:
+			files[c].close()
+	with open(os.path.join(folder, 'meta.json'), 'w') as f:
+		json.dump({'dtypes': col_dtypes, 'date': date, 'rows': rows,
+			'readings_per_person': total_readings}, f)
+	return folder
+
+#loads a dataset written by write_columnar_batches as a dataframe with the csv columns.
+#With mmap the columns are memory mapped instead of read.
+def read_columnar_dataset(folder, mmap=False):
+	with open(os.path.join(folder, 'meta.json')) as f:
+		meta = json.load(f)
+	cols = {}
+	for c in meta['dtypes']:
+		path = os.path.join(folder, c + '.bin')
+		if(mmap):
+			cols[c] = np.memmap(path, dtype=str(meta['dtypes'][c]), mode='r')
+		else:
+			cols[c] = np.fromfile(path, dtype=str(meta['dtypes'][c]))
+	return pd.DataFrame({'name': cols['name'], 'lat': cols['lat'], 'lon': cols['lon'],
+		'date': meta['date'], 'time': cols['time'],
+		'condition': np.where(cols['condition'] == 1, 'sick', 'healthy')},
+		columns=col_names,
+		index=np.tile(np.arange(meta['readings_per_person']), meta['rows'] // meta['readings_per_person']))
+
+#writes batches of readings in the format set by gen_output_format. Returns the path written.
+def write_batches(batches, filename):
+	if(gen_output_format == 2):
+		return write_columnar_batches(batches, filename)
+	return write_csv_batches(batches, filename, compress=(gen_output_format == 1))
 
-	datasetdf = datasetdf.append(generate_dyndata(glinger,name,condition,reglocindex))
-	reglocindex = reglocindex + 1
-	if(reglocindex>=total_linger_start_loc):
-		reglocindex = 0
-
-	print("Generated data points for: " + str(p+1) + " people.")
+##### main #####
 
-print("Completed generation...now writing to CSV file...")
-datasetdf.to_csv("cov19_gen_dataset.csv")
-print("Wrote file. Generator will exit now.")
-#print(datasetdf)
+if __name__ == '__main__':
+	print("Configurations are: ")
+	print("------------------------------------")
+	print("Total population: " + str(total_pop))
+	print("Max sick allowed: " + str(no_of_sick_allowed))
+	print("Total location readings per person: " + str(total_readings))
+	print("Geo location bounding box coordinates are: ")
+	print(str(latstart))
+	print(str(latend))
+	print(str(lonstart))
+	print(str(lonend))
+	print("Time range of location readings are: ")
+	print(str(timehr_range_start))
+	print(str(timehr_range_end))
+	print(str(timemm_range_start))
+	print(str(timemm_range_end))
+	print("Number of start locations to be generated for regimented loc paths: " + str(total_linger_start_loc))
+	print("Regimented loc path move bearing factor: " + str(linger_mov_angle_mulfactor))
+	print('-------------------------------------')
+	time.sleep(startup_pause)
+
+	if(batch_gen == 1):
+		print("Starting batch generation of data, writing it out as it is generated ...")
+		seed = gen_run_seed()
+		print("Seed: " + str(seed))
+		path = write_batches(gen_population_batches(total_pop, seed), "cov19_gen_dataset")
+		print("Generated data points for: " + str(total_pop) + " people.")
+		print("Wrote: " + path + ". Generator will exit now.")
+	else:
+		print("Starting generation of data ...")
+		reglocdf = gen_reg_start_loc(total_linger_start_loc)
+		print("Regimented start locations are: ")
+		print(reglocdf)
+
+		for p in range(0, total_pop):
+			name = ''.join(random.choice(string.ascii_uppercase) for _ in range(name_size))
+			#print(name)
+			condition = "healthy"
+			if(mark_sick==0):
+				con = random.randint(10,20)
+				if(con>=15):
+					condition = "sick"
+					curr_sick = curr_sick + 1
+					if(curr_sick>=no_of_sick_allowed):
+						mark_sick = 1
+
+			#print("Person: " + name + " is: " + condition)
+			if(glinger):
+				glinger = False
+			else:
+				glinger = True
+
+			datasetdf = datasetdf.append(generate_dyndata(glinger,name,condition,reglocindex))
+			reglocindex = reglocindex + 1
+			if(reglocindex>=total_linger_start_loc):
+				reglocindex = 0
+
+			print("Generated data points for: " + str(p+1) + " people.")
+
+		print("Completed generation...now writing to CSV file...")
+		datasetdf.to_csv("cov19_gen_dataset.csv")
+		print("Wrote file. Generator will exit now.")
+		#print(datasetdf)
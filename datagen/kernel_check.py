@@ -0,0 +1,142 @@
+'''
+Checks the haversine distance kernel of cov19_con_trace.py (distance_kernel = 1) against
+LatLon distances on every dataset shipped in this folder. For each dataset, the loc pairs of
+two different people that may breach the largest radius of kernel_check_radii are found
+with the spatial index, one person at a time, and:
+ - the haversine distance of every checked pair must be within distance_kernel_rtol of its
+   LatLon distance
+ - at every radius, the breach decision of find_distances (haversine, with the LatLon
+   recheck of pairs close to the radius) must be the same as the one LatLon makes
+
+Every pair within the recheck band of a radius is checked, as that is where the two methods
+can disagree. A kernel_check_sample share of the other pairs is checked too.
+
+Prints one row per dataset and radius and exits with status 1 if any check fails or there
+are no datasets to check.
+
+Dependencies:
+- same as cov19_con_trace.py
+
+'''
+
+import os
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import cov19_con_trace as ct
+
+##### All configurations start here #####
+
+#folder of this script, the shipped datasets are found from it whatever the current folder
+kernel_check_home = os.path.dirname(os.path.abspath(__file__))
+
+#datasets to check. All the shipped raw datasets by default.
+kernel_check_datasets = sorted(
+    glob.glob(os.path.join(kernel_check_home, 'cov19_gen_dataset_*', 'cov19_gen_dataset_*.csv')) +
+    glob.glob(os.path.join(kernel_check_home, 'cov19_gen_dataset_*', '*', 'cov19_gen_dataset_*.csv')) +
+    glob.glob(os.path.join(kernel_check_home, 'large_pop_datasets_only', 'cov19_gen_dataset_*.csv')))
+
+#microcell radii in km the breach decisions are checked at
+kernel_check_radii = [0.003, 0.005, 0.01]
+
+#share of the loc pairs outside the recheck bands that is checked, sampled with kernel_check_seed
+kernel_check_sample = 0.02
+kernel_check_seed = 2020
+
+#folder dataprep writes its preppd_df.csv to
+kernel_check_dir = 'kernel_check'
+
+##### All configurations end here   #####
+
+col_check = ['dataset', 'radius', 'pairs', 'checked', 'in_band', 'worst_rtol', 'breaches',
+    'mismatches']
+
+#prepares a dataset with cov19_con_trace.py and returns its trajectory store
+def load_dataset(path):
+    cwd = os.getcwd()
+    ct.datapath = os.path.abspath(path)
+    os.chdir(kernel_check_dir)
+    try:
+        ct.persons = []
+        return ct.build_trajectory_store(ct.dataprep())
+    finally:
+        os.chdir(cwd)
+
+#returns the loc pairs of person x with the people after them that may breach radius, as
+#arrays of reading indices into the store
+def person_pairs(store, spindex, x):
+    cands = ct.find_candidate_pairs(spindex, x)
+    offsets = store['offsets']
+    i1 = [offsets[x] + n for y in sorted(cands) if y > x for (n, m) in cands[y]]
+    i2 = [offsets[y] + m for y in sorted(cands) if y > x for (n, m) in cands[y]]
+    return np.array(i1, dtype=np.int64), np.array(i2, dtype=np.int64)
+
+#checks the kernel on one dataset. Pairs are gone through one person at a time so only
+#the ones picked for a LatLon check are kept. Returns its rows of the report.
+def check_dataset(path):
+    store = load_dataset(path)
+    maxradius = max(kernel_check_radii) * (1 + ct.distance_kernel_rtol)
+    spindex = ct.build_spatial_index(store, maxradius)
+    rng = np.random.RandomState(kernel_check_seed)
+    total = 0
+    inband = 0
+    picked = ([], [], [])
+    for x in range(0, ct.store_size(store)):
+        (i1, i2) = person_pairs(store, spindex, x)
+        dists = ct.haversine_km(store['lat'][i1], store['lon'][i1], store['lat'][i2], store['lon'][i2])
+        band = np.zeros(len(dists), dtype=bool)
+        for radius in kernel_check_radii:
+            band |= np.abs(dists - radius) <= ct.distance_kernel_rtol * radius
+        pick = band | (rng.random_sample(len(dists)) < kernel_check_sample)
+        total = total + len(dists)
+        inband = inband + int(band.sum())
+        picked[0].append(i1[pick])
+        picked[1].append(i2[pick])
+        picked[2].append(dists[pick])
+    (i1, i2, dists) = [np.concatenate(p) for p in picked]
+
+    ldists = np.array([ct.latlon_distance(store['lat'][a], store['lon'][a],
+        store['lat'][b], store['lon'][b]) for (a, b) in zip(i1, i2)], dtype=np.float64)
+    nonzero = ldists > 0
+    worst = 0.0
+    if(np.any(nonzero)):
+        worst = float((np.abs(dists - ldists)[nonzero] / ldists[nonzero]).max())
+
+    #radius_distances works on pairs given by person and node
+    person1 = np.searchsorted(store['offsets'], i1, side='right') - 1
+    person2 = np.searchsorted(store['offsets'], i2, side='right') - 1
+    pairs = {'person1': person1, 'node1': i1 - store['offsets'][person1],
+        'person2': person2, 'node2': i2 - store['offsets'][person2], 'dist': dists}
+    rows = []
+    for radius in kernel_check_radii:
+        breach = ct.radius_distances(pairs, store, radius) <= radius
+        rows.append({'dataset': os.path.relpath(path, kernel_check_home), 'radius': radius,
+            'pairs': total, 'checked': len(dists),
+            'in_band': inband, 'worst_rtol': worst, 'breaches': int(breach.sum()),
+            'mismatches': int(np.count_nonzero(breach != (ldists <= radius)))})
+    return rows
+
+################
+##### MAIN #####
+################
+if __name__ == '__main__':
+    ct.log_level = ct.log_warn
+    if(len(kernel_check_datasets) == 0):
+        ct.printcov("No datasets to check the distance kernel on.", ct.log_warn)
+        sys.exit(1)
+    if(not os.path.isdir(kernel_check_dir)):
+        os.makedirs(kernel_check_dir)
+    ct.printcov("Checking the distance kernel against LatLon on " + str(len(kernel_check_datasets)) +
+        " datasets.", ct.log_warn)
+    rows = []
+    for path in kernel_check_datasets:
+        rows.extend(check_dataset(path))
+    report = pd.DataFrame(rows, columns=col_check)
+    print(report.to_string())
+
+    failed = report[(report['worst_rtol'] > ct.distance_kernel_rtol) | (report['mismatches'] > 0)]
+    if(len(failed) > 0):
+        ct.printcov("Distance kernel out of tolerance on " + str(len(failed)) + " datasets / radii.", ct.log_warn)
+        sys.exit(1)
+    ct.printcov("Distance kernel within tolerance on all datasets.", ct.log_warn)
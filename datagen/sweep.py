@@ -0,0 +1,167 @@
+'''
+Runs a parameter sweep of Covid 19 contact tracing scenarios. A dataset is generated with
+generator.py for every combination of population, sick percent and number of linger start
+locations, in the same folder layout as the datasets in this repo
+(cov19_gen_dataset_pop-X_sickper-Y_startloc-Z). Each dataset is traced with cov19_con_trace.py
+for every microcell radius, graph analysis included, and the results are collected in one
+summary table, sweep_summary.csv. The travel history and graph of every radius are saved
+next to the dataset, like microcell_radii does in cov19_con_trace.py, along with the stage
+times and counters of the dataset in run_stats.json.
+
+Work is shared across the sweep instead of rerunning both programs for every combination:
+ - every dataset is generated with the same seed. Sick draws have their own random stream so
+   datasets that only differ in sick percent have the same trajectories.
+ - loc pair distances of a set of trajectories are calculated once, for the largest radius,
+   and then thresholded at every radius for every sick percent.
+
+Configurations of generator.py and cov19_con_trace.py other than the ones swept here are
+used as they are set in those files.
+
+Dependencies:
+- same as generator.py and cov19_con_trace.py
+
+'''
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import generator as gen
+import cov19_con_trace as ct
+
+##### All configurations start here #####
+
+#populations, sick percents and number of linger start locations to generate datasets for.
+#Every combination is generated.
+sweep_pops = [10, 30]
+sweep_sick_percents = [3, 5]
+sweep_start_locs = [2, 7, 10]
+
+#microcell radii every dataset is traced with, in km like microcell_radius
+sweep_radii = [0.005, 0.01, 0.02]
+
+#seed used to generate every dataset, see gen_seed in generator.py
+sweep_seed = 2020
+
+#folder the datasets and the summary are written to
+sweep_dir = 'sweep'
+
+##### All configurations end here   #####
+
+col_summary = ['pop','sick_percent','start_locs','microcell_radius','people','readings','sick',
+    'candidate_pairs','breach_pairs','high_risk_pairs','infec_start_locs','people_at_risk',
+    'vulnerable_people','predicted_locs','communities','distances_reused','pair_secs','secs']
+
+#returns the name of the dataset of a combination, as used for the folders in this repo
+def dataset_name(pop, sickper, startlocs):
+    return "cov19_gen_dataset_pop-%02d_sickper-%02d_startloc-%02d" % (pop, sickper, startlocs)
+
+#generates the dataset of a combination with generator.py. Returns the path of its csv.
+def gen_dataset(pop, sickper, startlocs):
+    gen.total_pop = pop
+    gen.sick_percent = sickper
+    gen.no_of_sick_allowed = max(1, (pop * sickper) / 100)
+    gen.total_linger_start_loc = startlocs
+    gen.gen_output_format = 0
+
+    name = dataset_name(pop, sickper, startlocs)
+    folder = os.path.join(sweep_dir, name)
+    if(not os.path.isdir(folder)):
+        os.makedirs(folder)
+    return gen.write_batches(gen.gen_population_batches(pop, sweep_seed), os.path.join(folder, name))
+
+#prepares a dataset with cov19_con_trace.py and returns its trajectory store. dataprep
+#saves preppd_df.csv next to the dataset.
+def load_dataset(path):
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(path))
+    try:
+        ct.datapath = os.path.basename(path)
+        ct.persons = []
+        return ct.build_trajectory_store(ct.dataprep())
+    finally:
+        os.chdir(cwd)
+
+#returns whether two trajectory stores hold the same trajectories, conditions aside
+def same_trajectories(store1, store2):
+    for c in ('offsets', 'lat', 'lon', 'entry', 'exit'):
+        if(not np.array_equal(store1[c], store2[c])):
+            return False
+    return True
+
+#traces a dataset with cov19_con_trace.py for every radius of the sweep (see
+#overlaps_for_radii), from the loc pairs found for the largest one. Its travel histories,
+#graphs, analysis output and run stats are saved next to the dataset. Returns the results
+#per radius.
+def trace_dataset(path, store, pairs):
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(path))
+    try:
+        ct.known_infected_list = [store['names'][p] for p in range(0, ct.store_size(store))
+            if store['cons'][p] == 'sick']
+        results = ct.overlaps_for_radii(store, sweep_radii, pairs)
+        ct.save_run_stats("run_stats.json")
+        return results
+    finally:
+        os.chdir(cwd)
+
+#returns the row of the summary table of a dataset traced at one radius, result being
+#what overlaps_for_radii returns for the radius
+def summarize(result, store, radius, candidates):
+    sick = set(str(store['names'][p]) for p in range(0, ct.store_size(store)) if store['cons'][p] == 'sick')
+
+    #people with an infection start loc are at risk, healthy people in the communities of
+    #the infected are vulnerable
+    atrisk = set(ct.label_name(n) for n in result['infec_start_locs'])
+    vulnerable = set()
+    for (vulncomm, vulnppl) in result['vulnerable'].values():
+        vulnerable.update(vulnppl)
+
+    return {'microcell_radius': radius, 'people': ct.store_size(store), 'readings': len(store['lat']),
+        'sick': len(sick), 'candidate_pairs': candidates,
+        'breach_pairs': result['breach_pairs'], 'high_risk_pairs': result['high_risk_pairs'],
+        'infec_start_locs': len(result['infec_start_locs']), 'people_at_risk': len(atrisk),
+        'vulnerable_people': len(vulnerable - sick), 'predicted_locs': len(result['predicted']),
+        'communities': len(result['communities']), 'secs': result['secs']}
+
+#runs the whole sweep and returns the summary table. pair_secs is the time spent finding
+#the loc pairs of a dataset, 0 when reused, and secs the time each radius took on its own.
+def run_sweep():
+    rows = []
+    maxradius = max(sweep_radii)
+    for pop in sweep_pops:
+        for startlocs in sweep_start_locs:
+            refstore = None
+            pairs = None
+            for sickper in sweep_sick_percents:
+                path = gen_dataset(pop, sickper, startlocs)
+                #stats of this dataset only, reused distances are not counted again
+                ct.reset_run_stats()
+                store = load_dataset(path)
+                reused = refstore is not None and same_trajectories(refstore, store)
+                pairsecs = 0.0
+                if(not reused):
+                    start = time.time()
+                    pairs = ct.find_pair_distances(store, maxradius)
+                    pairsecs = time.time() - start
+                    refstore = store
+                results = trace_dataset(path, store, pairs)
+                for radius in sweep_radii:
+                    row = summarize(results[radius], store, radius, len(pairs['dist']))
+                    row.update({'pop': pop, 'sick_percent': sickper, 'start_locs': startlocs,
+                        'distances_reused': int(reused), 'pair_secs': pairsecs})
+                    rows.append(row)
+                ct.printcov("Swept: " + dataset_name(pop, sickper, startlocs))
+
+    return pd.DataFrame(rows, columns=col_summary)
+
+################
+##### MAIN #####
+################
+if __name__ == '__main__':
+    ct.printcov("Starting sweep of " + str(len(sweep_pops) * len(sweep_sick_percents) * len(sweep_start_locs)) +
+        " datasets and " + str(len(sweep_radii)) + " microcell radii in: " + sweep_dir)
+    summary = run_sweep()
+    print(summary)
+    summary.to_csv(os.path.join(sweep_dir, "sweep_summary.csv"))
+    ct.printcov("Saved sweep summary to: " + os.path.join(sweep_dir, "sweep_summary.csv"))